@@ -27,9 +27,11 @@ from __future__ import annotations
 
 import collections
 import logging
+import os
+import struct
 import threading
 from dataclasses import dataclass
-from typing import Deque, Iterable, List, Optional
+from typing import Iterable, List, Optional
 
 import serial
 from serial import SerialException
@@ -54,6 +56,18 @@ RSP_ACK_MASK = 0x80
 RSP_STATUS = 0x90
 RSP_ERROR = 0x91
 
+# Acquittements attendus (commande | RSP_ACK_MASK)
+ACK_COMMANDS = frozenset(
+    cmd | RSP_ACK_MASK for cmd in (CMD_PING, CMD_HOME, CMD_SELECT_GATE, CMD_QUERY_STATUS)
+)
+
+# Nombre d'erreurs conservées dans le statut publié
+ERROR_HISTORY_SIZE = 10
+
+# Table de décodage des 4 bits de poids faible d'un octet d'état (portes,
+# présence filament) : un index au lieu de quatre masques par trame.
+_NIBBLE_BITS = tuple(tuple(bool(n & (1 << i)) for i in range(4)) for n in range(16))
+
 
 # Implémentation du checksum CRC8 DVB-S2
 # Référence : table utilisée dans les routines bambubus du firmware
@@ -86,7 +100,7 @@ def crc16_bambu(data: Iterable[int]) -> int:
     return crc & 0xFFFF
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class BambuPacket:
     """Représente une trame bambubus décodée."""
 
@@ -105,6 +119,12 @@ class BambuBusCodec:
         self.src_addr = src_addr & 0xFF
         self.dst_addr = dst_addr & 0xFF
         self._sequence = 0
+        # Tampon de travail réutilisé pour les trames courtes (2 + SHORT_MAX_BODY octets)
+        self._tx_buf = bytearray(2 + SHORT_MAX_BODY)
+        self._tx_mv = memoryview(self._tx_buf)
+        # Trames complètes déjà encodées, indexées par (commande, payload) puis
+        # par numéro de séquence : seul ce dernier varie d'un envoi à l'autre.
+        self._frame_cache: dict[tuple[int, bytes], List[Optional[bytes]]] = {}
 
     @staticmethod
     def _encode_length(payload_len: int, long_frame: bool) -> bytearray:
@@ -137,6 +157,8 @@ class BambuBusCodec:
     def build_packet(self, command: int, payload: bytes = b"", *, dst_addr: Optional[int] = None) -> bytes:
         payload = payload or b""
         long_frame = len(payload) + 8 > SHORT_MAX_BODY
+        if not long_frame:
+            return self._build_short_packet(command, payload, dst_addr)
         length_field = self._encode_length(len(payload), long_frame)
 
         frame = bytearray(PREAMBLE)
@@ -156,51 +178,100 @@ class BambuBusCodec:
         frame.extend([crc16 & 0xFF, (crc16 >> 8) & 0xFF])
         return bytes(frame)
 
+    def build_cached_packet(self, command: int, payload: bytes = b"") -> bytes:
+        """Variante de `build_packet` mémorisant les trames à payload fixe.
+
+        Une fois les 256 numéros de séquence parcourus, l'envoi d'une
+        commande récurrente (ping, requête de statut...) ne recalcule plus
+        aucun CRC.
+        """
+        key = (command & 0xFF, bytes(payload))
+        slots = self._frame_cache.get(key)
+        if slots is None:
+            slots = self._frame_cache[key] = [None] * 256
+        sequence = self._sequence
+        frame = slots[sequence]
+        if frame is None:
+            frame = slots[sequence] = self.build_packet(command, payload)
+        else:
+            self._sequence = (sequence + 1) & 0xFF
+        return frame
+
+    def _build_short_packet(self, command: int, payload: bytes, dst_addr: Optional[int]) -> bytes:
+        # Trame courte écrite en place dans le tampon de travail : pas de
+        # réallocation à chaque extend/append.
+        body_len = len(payload) + 8
+        sequence = self._sequence
+        self._sequence = (self._sequence + 1) & 0xFF
+        buf = self._tx_buf
+        view = self._tx_mv
+        struct.pack_into(
+            "<2s5B",
+            buf,
+            0,
+            PREAMBLE,
+            body_len,
+            sequence,
+            self.src_addr,
+            (dst_addr if dst_addr is not None else self.dst_addr) & 0xFF,
+            command & 0xFF,
+        )
+        buf[7] = crc8_dvb_s2(view[:7])
+        payload_end = 8 + len(payload)
+        view[8:payload_end] = payload
+        crc16 = crc16_bambu(view[:payload_end])
+        struct.pack_into("<H", buf, payload_end, crc16)
+        return bytes(view[: payload_end + 2])
+
     @staticmethod
-    def extract_packets(buffer: Deque[int]) -> List[BambuPacket]:
+    def extract_packets(buffer: bytearray) -> List[BambuPacket]:
+        # La recherche du préambule se fait directement dans le tampon de
+        # réception (bytearray.find, en C) et les trames y sont lues via une
+        # memoryview, sans copie ; les octets traités sont retirés en une seule
+        # opération à la fin, une fois la vue libérée.
         packets: List[BambuPacket] = []
-        temp = bytearray(buffer)
         start = 0
-        while True:
-            sync = temp.find(PREAMBLE, start)
-            if sync == -1:
-                break
-            if sync + 3 > len(temp):
-                break
-            try:
-                body_len, length_size, is_long = BambuBusCodec._decode_length(temp, sync + 2)
-            except ValueError:
-                start = sync + 1
-                continue
-            frame_len = 2 + body_len
-            end = sync + frame_len
-            if end > len(temp):
-                break
-            frame = temp[sync:end]
-            header_crc_idx = 2 + length_size + 4
-            header_crc = frame[header_crc_idx]
-            header_without_crc = frame[:header_crc_idx]
-            if crc8_dvb_s2(header_without_crc) != header_crc:
-                LOG.debug("Trame rejetée (CRC8 invalide): %s", frame.hex())
-                start = sync + 1
-                continue
-            payload_end = frame_len - 2
-            payload = frame[header_crc_idx + 1 : payload_end]
-            crc16_received = frame[payload_end] | (frame[payload_end + 1] << 8)
-            if crc16_bambu(frame[:payload_end]) != crc16_received:
-                LOG.debug("Trame rejetée (CRC16 invalide): %s", frame.hex())
-                start = sync + 1
-                continue
-            seq_idx = 2 + length_size
-            sequence = frame[seq_idx]
-            src = frame[seq_idx + 1]
-            dst = frame[seq_idx + 2]
-            command = frame[seq_idx + 3]
-            packets.append(BambuPacket(sequence, src, dst, command, bytes(payload), is_long))
-            start = end
-        consumed = start
-        for _ in range(consumed):
-            buffer.popleft()
+        with memoryview(buffer) as view:
+            while True:
+                sync = buffer.find(PREAMBLE, start)
+                if sync == -1:
+                    break
+                if sync + 3 > len(buffer):
+                    break
+                try:
+                    body_len, length_size, is_long = BambuBusCodec._decode_length(buffer, sync + 2)
+                except ValueError:
+                    start = sync + 1
+                    continue
+                frame_len = 2 + body_len
+                end = sync + frame_len
+                if end > len(buffer):
+                    break
+                header_crc_idx = 2 + length_size + 4
+                payload_end = frame_len - 2
+                with view[sync:end] as frame:
+                    if crc8_dvb_s2(frame[:header_crc_idx]) != frame[header_crc_idx]:
+                        if LOG.isEnabledFor(logging.DEBUG):
+                            LOG.debug("Trame rejetée (CRC8 invalide): %s", frame.hex())
+                        start = sync + 1
+                        continue
+                    crc16_received = frame[payload_end] | (frame[payload_end + 1] << 8)
+                    if crc16_bambu(frame[:payload_end]) != crc16_received:
+                        if LOG.isEnabledFor(logging.DEBUG):
+                            LOG.debug("Trame rejetée (CRC16 invalide): %s", frame.hex())
+                        start = sync + 1
+                        continue
+                    seq_idx = 2 + length_size
+                    packets.append(BambuPacket(
+                        frame[seq_idx],
+                        frame[seq_idx + 1],
+                        frame[seq_idx + 2],
+                        frame[seq_idx + 3],
+                        bytes(frame[header_crc_idx + 1 : payload_end]),
+                        is_long,
+                    ))
+                start = end
+        del buffer[:start]
         return packets
 
 
@@ -242,11 +313,13 @@ class BMCU:
             fallback_baud,
             use_custom_baudrate,
         )
+        self._serial_fd = self._open_raw_fd()
 
         self.codec = BambuBusCodec(self.src_addr, self.dst_addr)
-        self._rx_buffer: Deque[int] = collections.deque()
+        self._rx_buffer = bytearray()
         self._write_lock = threading.Lock()
         self._read_timer = None
+        self._fd_handle = None
         self._status_timer = None
         self._running = True
 
@@ -254,12 +327,16 @@ class BMCU:
         self._state = {
             'online': False,
             'active_gate': None,
-            'doors': [False, False, False, False],
-            'filament_present': [False, False, False, False],
+            'doors': _NIBBLE_BITS[0],
+            'filament_present': _NIBBLE_BITS[0],
             'error_code': 0,
-            'error_history': [],
+            'error_history': collections.deque(maxlen=ERROR_HISTORY_SIZE),
         }
 
+        # Table de dispatch des trames reçues, construite une seule fois
+        self._cmd_handlers = {RSP_STATUS: self._on_status, RSP_ERROR: self._on_error}
+        self._cmd_handlers.update(dict.fromkeys(ACK_COMMANDS, self._on_ack))
+
         self.gcode.register_command("BMCU_SELECT_GATE", self.cmd_BMCU_SELECT_GATE, desc=self.cmd_BMCU_SELECT_GATE_help)
         self.gcode.register_command("BMCU_HOME", self.cmd_BMCU_HOME, desc=self.cmd_BMCU_HOME_help)
         self.gcode.register_command("BMCU_CHECK_GATE", self.cmd_BMCU_CHECK_GATE, desc=self.cmd_BMCU_CHECK_GATE_help)
@@ -374,11 +451,26 @@ class BMCU:
         )
         _close_and_raise(suggestion)
 
+    def _open_raw_fd(self) -> Optional[int]:
+        # Lecture directe sur le descripteur du TTY : un seul appel système par
+        # cycle, sans ioctl `in_waiting` ni copie intermédiaire de PySerial.
+        try:
+            fd = self.serial_conn.fileno()
+            os.set_blocking(fd, False)
+        except (AttributeError, OSError, ValueError, SerialException):
+            return None
+        return fd
+
     # ------------------------------------------------------------------
     # Boucles de communication
 
     def _handle_ready(self):
-        if not self._read_timer:
+        # Le réacteur réveille le module uniquement quand le TTY a des données ;
+        # le sondage périodique ne sert que si aucun descripteur n'est exposé.
+        if self._serial_fd is not None:
+            if self._fd_handle is None:
+                self._fd_handle = self.reactor.register_fd(self._serial_fd, self._on_serial_readable)
+        elif not self._read_timer:
             self._read_timer = self.reactor.register_timer(self._poll_serial, self.reactor.NOW)
         if not self._status_timer:
             self._status_timer = self.reactor.register_timer(self._poll_status, self.reactor.monotonic() + 0.5)
@@ -386,6 +478,9 @@ class BMCU:
 
     def _handle_shutdown(self):
         self._running = False
+        if self._fd_handle is not None:
+            self.reactor.unregister_fd(self._fd_handle)
+            self._fd_handle = None
         if self._read_timer is not None:
             self.reactor.unregister_timer(self._read_timer)
             self._read_timer = None
@@ -415,21 +510,76 @@ class BMCU:
             self._send_command(CMD_PING)
         return eventtime + 0.5
 
+    def _on_serial_readable(self, eventtime):
+        if not self._running:
+            return
+        try:
+            chunk = os.read(self._serial_fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError as exc:
+            LOG.error("Lecture série BMCU échouée: %s", exc)
+            self._drop_serial(eventtime)
+            return
+        if not chunk:
+            # Fin de fichier : le TTY a disparu (câble USB débranché)
+            LOG.error("Port série BMCU fermé par le périphérique")
+            self._drop_serial(eventtime)
+            return
+        self._ingest_data(chunk)
+
+    def _drop_serial(self, eventtime):
+        # Un descripteur en erreur reste signalé prêt par le réacteur : il est
+        # retiré et le port fermé, puis le sondage le rouvre toutes les secondes.
+        if self._fd_handle is not None:
+            self.reactor.unregister_fd(self._fd_handle)
+            self._fd_handle = None
+        self._serial_fd = None
+        try:
+            self.serial_conn.close()
+        except SerialException:
+            pass
+        self._rx_buffer.clear()
+        self._state['online'] = False
+        self._state['error_code'] = 0
+        if self._read_timer is None:
+            self._read_timer = self.reactor.register_timer(self._poll_serial, eventtime + 1.0)
+
+    def _reopen_serial(self) -> bool:
+        try:
+            self.serial_conn.open()
+        except (SerialException, OSError) as exc:
+            LOG.error("Réouverture du port série BMCU échouée: %s", exc)
+            return False
+        LOG.info("Port série BMCU rouvert")
+        self._serial_fd = self._open_raw_fd()
+        return True
+
     def _poll_serial(self, eventtime):
         if not self._running:
             return self.reactor.NEVER
+        if not self.serial_conn.is_open:
+            if not self._reopen_serial():
+                return eventtime + 1.0
+            if self._serial_fd is not None:
+                # Retour à la lecture sur événement : le sondage s'arrête.
+                self._fd_handle = self.reactor.register_fd(self._serial_fd, self._on_serial_readable)
+                self.reactor.unregister_timer(self._read_timer)
+                self._read_timer = None
+                return self.reactor.NEVER
         try:
             waiting = getattr(self.serial_conn, 'in_waiting', 0)
             chunk = self.serial_conn.read(waiting or 64)
         except SerialException as exc:
             LOG.error("Lecture série BMCU échouée: %s", exc)
+            self._drop_serial(eventtime)
             return eventtime + 1.0
         if chunk:
             self._ingest_data(chunk)
         return eventtime + self.poll_interval
 
     def _ingest_data(self, data: bytes) -> None:
-        self._rx_buffer.extend(data)
+        self._rx_buffer += data
         for packet in BambuBusCodec.extract_packets(self._rx_buffer):
             self._handle_packet(packet)
 
@@ -437,55 +587,68 @@ class BMCU:
     # Gestion des trames
 
     def _handle_packet(self, packet: BambuPacket) -> None:
-        LOG.debug(
-            "Trame reçue (seq=%d src=%02x dst=%02x cmd=%02x len=%d)",
-            packet.sequence,
-            packet.src,
-            packet.dst,
-            packet.command,
-            len(packet.payload),
-        )
+        # Les journaux de debug sont évalués uniquement s'ils sont actifs :
+        # `.hex()` et `repr(dict)` coûtent cher à 1,25 Mbaud.
+        debug = LOG.isEnabledFor(logging.DEBUG)
+        if debug:
+            LOG.debug(
+                "Trame reçue (seq=%d src=%02x dst=%02x cmd=%02x len=%d)",
+                packet.sequence,
+                packet.src,
+                packet.dst,
+                packet.command,
+                len(packet.payload),
+            )
         self._last_contact = self.reactor.monotonic()
-        if packet.command & RSP_ACK_MASK and (packet.command & 0x7F) in (CMD_PING, CMD_HOME, CMD_SELECT_GATE, CMD_QUERY_STATUS):
-            self._state['online'] = True
-            return
-        if packet.command == RSP_STATUS and len(packet.payload) >= 5:
-            self._state['online'] = True
-            doors_bits = packet.payload[0]
-            filament_bits = packet.payload[1]
-            active_gate = packet.payload[3]
-            self._state['doors'] = [bool(doors_bits & (1 << i)) for i in range(4)]
-            self._state['filament_present'] = [bool(filament_bits & (1 << i)) for i in range(4)]
-            self._state['active_gate'] = active_gate if active_gate < 4 else None
-            error_code = packet.payload[2]
-            if error_code:
-                self._state['error_code'] = error_code
-                history = self._state['error_history']
-                history.append({'code': error_code, 'sequence': packet.sequence})
-                del history[:-10]
-            else:
-                self._state['error_code'] = 0
+        handler = self._cmd_handlers.get(packet.command)
+        if (handler is None or not handler(packet)) and debug:
+            LOG.debug("Trame non gérée: cmd=%02x payload=%s", packet.command, packet.payload.hex())
+
+    def _on_ack(self, packet: BambuPacket) -> bool:
+        self._state['online'] = True
+        return True
+
+    def _on_status(self, packet: BambuPacket) -> bool:
+        payload = packet.payload
+        if len(payload) < 5:
+            return False
+        doors_bits, filament_bits, error_code, active_gate = payload[:4]
+        state = self._state
+        state['online'] = True
+        state['doors'] = _NIBBLE_BITS[doors_bits & 0x0F]
+        state['filament_present'] = _NIBBLE_BITS[filament_bits & 0x0F]
+        state['active_gate'] = active_gate if active_gate < 4 else None
+        state['error_code'] = error_code
+        if error_code:
+            state['error_history'].append({'code': error_code, 'sequence': packet.sequence})
+        if LOG.isEnabledFor(logging.DEBUG):
             LOG.debug("Statut BMCU mis à jour: %s", self._state)
-            return
-        if packet.command == RSP_ERROR and packet.payload:
-            code = packet.payload[0]
-            self._state['error_code'] = code
-            self._state['error_history'].append({'code': code, 'sequence': packet.sequence})
-            self._state['error_history'] = self._state['error_history'][-10:]
-            LOG.warning("Erreur BMCU %02x (payload=%s)", code, packet.payload.hex())
-            return
-        LOG.debug("Trame non gérée: cmd=%02x payload=%s", packet.command, packet.payload.hex())
+        return True
+
+    def _on_error(self, packet: BambuPacket) -> bool:
+        if not packet.payload:
+            return False
+        code = packet.payload[0]
+        self._state['error_code'] = code
+        self._state['error_history'].append({'code': code, 'sequence': packet.sequence})
+        LOG.warning("Erreur BMCU %02x (payload=%s)", code, packet.payload.hex())
+        return True
 
     # ------------------------------------------------------------------
     # Construction des trames sortantes
 
     def _send_command(self, command: int, payload: bytes = b"") -> None:
+        if not self.serial_conn.is_open:
+            # Port fermé après une erreur : `_poll_serial` le rouvrira.
+            return
         with self._write_lock:
-            frame = self.codec.build_packet(command, payload)
-            LOG.debug("Envoi trame BMCU cmd=%02x: %s", command, frame.hex())
+            frame = self.codec.build_cached_packet(command, payload)
+            if LOG.isEnabledFor(logging.DEBUG):
+                LOG.debug("Envoi trame BMCU cmd=%02x: %s", command, frame.hex())
             try:
+                # Pas de flush() : tcdrain() bloquerait le réacteur jusqu'à la
+                # vidange de la FIFO UART, le noyau s'en charge seul.
                 self.serial_conn.write(frame)
-                self.serial_conn.flush()
             except SerialException as exc:
                 LOG.error("Échec d'écriture vers le BMCU: %s", exc)
 
@@ -518,7 +681,9 @@ class BMCU:
     # Statut Klipper
 
     def get_status(self, eventtime):
-        return dict(self._state)
+        state = dict(self._state)
+        state['error_history'] = list(state['error_history'])
+        return state
 
 
 def load_config(config):
@@ -1,11 +1,11 @@
 from __future__ import annotations
 
-import collections
-from typing import Deque
+import os
+from unittest.mock import MagicMock
 
 import pytest
 
-from addon.bmcu import BambuBusCodec, BambuPacket, crc8_dvb_s2, crc16_bambu
+from addon.bmcu import BMCU, BambuBusCodec, BambuPacket, crc8_dvb_s2, crc16_bambu
 
 # Golden values for CRC checks, based on the current implementation.
 # These tests will lock in the behavior and prevent regressions.
@@ -62,7 +62,7 @@ def test_decode_simple_ack_packet():
     ack_codec = BambuBusCodec(src_addr=0x11, dst_addr=0x01)
     frame = ack_codec.build_packet(command=0x81) # ACK for command 0x01
 
-    buffer: Deque[int] = collections.deque(frame)
+    buffer = bytearray(frame)
     packets = BambuBusCodec.extract_packets(buffer)
 
     assert len(packets) == 1
@@ -81,7 +81,7 @@ def test_decode_status_response_packet():
     status_codec = BambuBusCodec(src_addr=0x11, dst_addr=0x01)
     payload = b"\x00\x00\x00\x02\x00"
     frame = status_codec.build_packet(command=0x90, payload=payload)
-    buffer: Deque[int] = collections.deque(frame)
+    buffer = bytearray(frame)
 
     packets = BambuBusCodec.extract_packets(buffer)
 
@@ -97,7 +97,7 @@ def test_decode_stream_with_multiple_packets():
     ack_codec = BambuBusCodec(src_addr=0x11, dst_addr=0x01)
     frame1 = ack_codec.build_packet(command=0x81)
     frame2 = ack_codec.build_packet(command=0x90, payload=b'\x01')
-    buffer: Deque[int] = collections.deque(frame1 + frame2)
+    buffer = bytearray(frame1 + frame2)
 
     packets = BambuBusCodec.extract_packets(buffer)
 
@@ -112,7 +112,7 @@ def test_decode_with_leading_garbage():
     garbage = b"\x00\x01\x02\x03"
     ack_codec = BambuBusCodec(src_addr=0x11, dst_addr=0x01)
     frame = ack_codec.build_packet(command=0x81)
-    buffer: Deque[int] = collections.deque(garbage + frame)
+    buffer = bytearray(garbage + frame)
 
     packets = BambuBusCodec.extract_packets(buffer)
 
@@ -126,7 +126,7 @@ def test_decode_invalid_crc8_is_rejected():
     ack_codec = BambuBusCodec(src_addr=0x11, dst_addr=0x01)
     frame = bytearray(ack_codec.build_packet(command=0x81))
     frame[7] ^= 0xFF # Corrupt CRC8
-    buffer: Deque[int] = collections.deque(frame)
+    buffer = bytearray(frame)
 
     packets = BambuBusCodec.extract_packets(buffer)
 
@@ -138,8 +138,72 @@ def test_decode_invalid_crc16_is_rejected():
     ack_codec = BambuBusCodec(src_addr=0x11, dst_addr=0x01)
     frame = bytearray(ack_codec.build_packet(command=0x81))
     frame[-1] ^= 0xFF # Corrupt CRC16
-    buffer: Deque[int] = collections.deque(frame)
+    buffer = bytearray(frame)
 
     packets = BambuBusCodec.extract_packets(buffer)
 
     assert len(packets) == 0
+
+
+def test_cached_packets_match_fresh_encoding(codec: BambuBusCodec):
+    """Test that cached frames are identical to freshly built ones."""
+    reference = BambuBusCodec(src_addr=0x01, dst_addr=0x11)
+    payload = b"\x00\x02\x00"
+    for _ in range(300):
+        assert codec.build_cached_packet(0x03, payload) == reference.build_packet(0x03, payload)
+        assert codec.build_cached_packet(0x01) == reference.build_packet(0x01)
+
+
+def test_decode_keeps_trailing_partial_frame():
+    """Test that consumed bytes are dropped while an incomplete frame is kept."""
+    ack_codec = BambuBusCodec(src_addr=0x11, dst_addr=0x01)
+    frame1 = ack_codec.build_packet(command=0x81)
+    frame2 = ack_codec.build_packet(command=0x90, payload=b'\x01')
+    buffer = bytearray(b"\xff\x3d\x00" + frame1 + frame2[:5])
+
+    packets = BambuBusCodec.extract_packets(buffer)
+
+    assert [packet.command for packet in packets] == [0x81]
+    assert buffer == frame2[:5]
+
+    buffer += frame2[5:]
+    assert [packet.command for packet in BambuBusCodec.extract_packets(buffer)] == [0x90]
+    assert not buffer
+
+
+def test_serial_eof_unregisters_fd_and_reopens_by_polling():
+    """An EOF on the TTY must stop the fd callback and fall back to polling."""
+    read_fd, write_fd = os.pipe()
+    os.close(write_fd)  # os.read() now returns b"" (EOF), like an unplugged TTY.
+
+    driver = BMCU.__new__(BMCU)
+    driver.reactor = MagicMock(NEVER=float("inf"))
+    driver.serial_conn = MagicMock(is_open=True)
+    driver._serial_fd = read_fd
+    driver._fd_handle = fd_handle = object()
+    driver._read_timer = None
+    driver._running = True
+    driver._rx_buffer = bytearray(b"\x3d")
+    driver._state = {'online': True, 'error_code': 3}
+
+    try:
+        driver._on_serial_readable(10.0)
+    finally:
+        os.close(read_fd)
+
+    driver.reactor.unregister_fd.assert_called_once_with(fd_handle)
+    driver.serial_conn.close.assert_called_once()
+    assert driver._fd_handle is None and driver._serial_fd is None
+    assert driver._state['online'] is False and not driver._rx_buffer
+    driver.reactor.register_timer.assert_called_once_with(driver._poll_serial, 11.0)
+
+    # The next poll reopens the port and hands reading back to the fd callback.
+    driver.serial_conn.is_open = False
+    driver.serial_conn.fileno.return_value = new_fd = os.open(os.devnull, os.O_RDONLY)
+    try:
+        assert driver._poll_serial(11.0) == driver.reactor.NEVER
+    finally:
+        os.close(new_fd)
+    driver.serial_conn.open.assert_called_once()
+    driver.reactor.register_fd.assert_called_once_with(new_fd, driver._on_serial_readable)
+    assert driver._read_timer is None
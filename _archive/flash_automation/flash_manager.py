@@ -25,8 +25,12 @@ from __future__ import annotations
 
 import glob
 import subprocess
+from collections import deque
 from pathlib import Path
 
+# Nombre de lignes de sortie conservées pour le message d'erreur.
+OUTPUT_TAIL_LINES = 200
+
 class FlashManagerError(Exception):
     """Exception spécifique pour les erreurs de flashage."""
 
@@ -38,25 +42,35 @@ class FlashManager:
         self.base_dir = base_dir
 
     def _run_command(self, command: list[str]) -> None:
-        """Exécute une commande et lève une exception détaillée en cas d'échec."""
+        """Exécute une commande et lève une exception détaillée en cas d'échec.
+
+        La sortie (stderr fusionné dans stdout) est relayée ligne par ligne au
+        fil de l'exécution ; seules les dernières lignes sont conservées pour
+        le message d'erreur.
+        """
+        tail: deque[str] = deque(maxlen=OUTPUT_TAIL_LINES)
         try:
-            subprocess.run(
+            with subprocess.Popen(
                 command,
-                check=True,
-                capture_output=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
                 text=True,
                 encoding="utf-8",
                 errors="replace",
-            )
+                bufsize=1,
+            ) as process:
+                for line in process.stdout:
+                    print(line, end="", flush=True)
+                    tail.append(line)
+                returncode = process.wait()
         except FileNotFoundError as e:
             raise FlashManagerError(f"La commande '{command[0]}' est introuvable. Est-elle installée et dans le PATH ?") from e
-        except subprocess.CalledProcessError as e:
+        if returncode != 0:
             error_message = (
-                f"La commande `{' '.join(command)}` a échoué (code {e.returncode}).\n"
-                f"--- STDOUT ---\n{e.stdout}\n"
-                f"--- STDERR ---\n{e.stderr}"
+                f"La commande `{' '.join(command)}` a échoué (code {returncode}).\n"
+                f"--- SORTIE (dernières lignes) ---\n{''.join(tail)}"
             )
-            raise FlashManagerError(error_message) from e
+            raise FlashManagerError(error_message)
 
     def detect_serial_devices(self) -> list[str]:
         """Détecte les périphériques série disponibles."""
@@ -12,6 +12,7 @@ placé dans ``~/.local/bin``.
 from __future__ import annotations
 
 import hashlib
+import mmap
 import os
 import platform
 import shutil
@@ -137,10 +138,12 @@ def verify_checksum(path: Path, expected: str | None) -> None:
         )
         return
 
+    # Hachage direct des pages projetées en mémoire : aucune copie par bloc.
     digest = hashlib.sha256()
     with path.open("rb") as handle:
-        for chunk in iter(lambda: handle.read(65536), b""):
-            digest.update(chunk)
+        if os.fstat(handle.fileno()).st_size:
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
 
     actual = digest.hexdigest()
     if actual.lower() != expected.lower():
@@ -204,13 +207,17 @@ def extract_binary(archive_path: Path, workdir: Path) -> Path:
 
 
 def install_binary(source: Path, destination_dir: Path) -> Path:
-    """Copie ``source`` dans ``destination_dir`` et rend le fichier exécutable."""
+    """Copie ``source`` dans ``destination_dir`` et rend le fichier exécutable.
+
+    Seul le contenu est copié : les dates et attributs étendus du fichier
+    extrait dans le répertoire temporaire ne sont pas conservés.
+    """
 
     destination_dir.mkdir(parents=True, exist_ok=True)
     destination = destination_dir / "wchisp"
 
     try:
-        shutil.copy2(source, destination)
+        shutil.copyfile(source, destination)
     except OSError as err:
         raise RuntimeError(f"Impossible de copier wchisp vers {destination}.") from err
 
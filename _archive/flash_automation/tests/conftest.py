@@ -1,28 +1,13 @@
 import pytest
-from pathlib import Path
-import shutil
 
 @pytest.fixture
 def isolated_cache(tmp_path):
     """
     Fixture to isolate tests from the real .cache directory.
-    It renames the real .cache directory, creates a new empty one for the test,
-    and restores the original directory after the test.
+    It provides an empty .cache directory inside the test's tmp_path, so the
+    repository's own cache is never renamed or deleted and pytest's tmp_path
+    retention takes care of the cleanup.
     """
-    base_path = Path(__file__).resolve().parents[1]
-    cache_path = base_path / ".cache"
-    backup_path = base_path / ".cache.bak"
-
-    if cache_path.exists():
-        cache_path.rename(backup_path)
-
-    # Create a fresh .cache for the test
+    cache_path = tmp_path / ".cache"
     cache_path.mkdir()
-
-    yield cache_path
-
-    # Teardown: restore the original .cache
-    if cache_path.exists():
-        shutil.rmtree(cache_path)
-    if backup_path.exists():
-        backup_path.rename(cache_path)
+    return cache_path
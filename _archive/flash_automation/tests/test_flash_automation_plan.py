@@ -1,5 +1,3 @@
-import hashlib
-import os
 import shutil
 import subprocess
 import textwrap
@@ -11,37 +9,21 @@ import pytest
 from flash_automation.build_manager import BuildManager
 from flash_automation.flash_manager import FlashManager
 
-FLASH_ROOT = Path(__file__).resolve().parents[1]
-BANNER_TEXT = (FLASH_ROOT / "banner.txt").read_text()
-
-STUB_ARCHIVE_CONTENT = b"stub archive"
-STUB_ARCHIVE_SHA256 = hashlib.sha256(STUB_ARCHIVE_CONTENT).hexdigest()
-
 def ensure_real_command(name: str) -> str:
     path = shutil.which(name)
     if path is None:
         raise RuntimeError(f"The command '{name}' must be available in PATH during tests")
     return path
 
-def create_stub_environment(
-    tmp_path: Path, *, include_system_path: bool = False, set_user: bool = True
-) -> tuple[dict[str, str], Path]:
+def create_stub_environment(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
     bin_dir = tmp_path / "bin"
     bin_dir.mkdir(parents=True, exist_ok=True)
-    env = os.environ.copy()
-    base_path = env.get("PATH", "") if include_system_path else ""
-    env["PATH"] = f"{bin_dir}{os.pathsep}{base_path}" if base_path else str(bin_dir)
-    env["HOME"] = str(tmp_path)
-    if set_user:
-        env["USER"] = env.get("USER", "testuser")
-    else:
-        env.pop("USER", None)
-    return env, bin_dir
+    monkeypatch.setenv("PATH", str(bin_dir))
+    return bin_dir
 
 def test_build_manager_compiles_firmware(tmp_path, monkeypatch):
     """Vérifie que BuildManager clone et compile le firmware."""
-    env, bin_dir = create_stub_environment(tmp_path)
-    monkeypatch.setenv("PATH", env["PATH"])
+    bin_dir = create_stub_environment(tmp_path, monkeypatch)
 
     # Stubs pour git et make
     git_stub = bin_dir / "git"
@@ -75,8 +57,7 @@ echo "fake firmware" > out/klipper.bin
 
     manager = BuildManager(tmp_path)
     manager.klipper_dir = tmp_path / "klipper"
-    manager.klipper_dir.mkdir()
-    (manager.klipper_dir / ".git").mkdir()
+    (manager.klipper_dir / ".git").mkdir(parents=True)
 
     # Crée un faux klipper.config
     (tmp_path / "klipper.config").write_text("CONFIG_FOO=y")
@@ -96,8 +77,7 @@ echo "fake firmware" > out/klipper.bin
 
 def test_flash_manager_flashes_serial(tmp_path, monkeypatch):
     """Vérifie que FlashManager appelle flash_usb.py pour la méthode série."""
-    env, bin_dir = create_stub_environment(tmp_path)
-    monkeypatch.setenv("PATH", env["PATH"])
+    bin_dir = create_stub_environment(tmp_path, monkeypatch)
 
     # Stub pour python3
     python_stub = bin_dir / "python3"
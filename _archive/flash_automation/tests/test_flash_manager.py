@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import subprocess
+import sys
 from pathlib import Path
 from unittest.mock import patch, MagicMock
 
@@ -87,3 +88,16 @@ def test_flash_serial_subprocess_failure_propagates(manager: FlashManager):
         mock_run.side_effect = FlashManagerError("Subprocess failed")
         with pytest.raises(FlashManagerError, match="Subprocess failed"):
             manager.flash_serial(firmware_path, device)
+
+
+def test_run_command_streams_output_and_keeps_tail(manager: FlashManager, capsys):
+    """Check that command output is relayed live and only its tail is kept on failure."""
+    script = "import sys; [print(i) for i in range(500)]; sys.stderr.write('erreur flash\\n'); sys.exit(3)"
+
+    with pytest.raises(FlashManagerError) as excinfo:
+        manager._run_command([sys.executable, "-c", script])
+
+    assert "0\n1\n" in capsys.readouterr().out
+    message = str(excinfo.value)
+    assert "code 3" in message and "erreur flash" in message
+    assert "499" in message and "\n100\n" not in message
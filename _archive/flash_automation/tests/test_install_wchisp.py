@@ -2,7 +2,9 @@
 
 from __future__ import annotations
 
+import hashlib
 import io
+import os
 import sys
 import tarfile
 from pathlib import Path
@@ -13,12 +15,12 @@ ROOT_DIR = Path(__file__).resolve().parents[2]
 if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
-from flash_automation.install_wchisp import extract_binary
+from flash_automation.install_wchisp import extract_binary, install_binary, verify_checksum
 
 
 def create_archive(tmp_path: Path, members: list[tuple[str, bytes]]) -> Path:
     archive_path = tmp_path / "wchisp.tar.gz"
-    with tarfile.open(archive_path, mode="w:gz") as tar:
+    with archive_path.open("wb") as fileobj, tarfile.open(fileobj=fileobj, mode="w|gz") as tar:
         for name, data in members:
             info = tarfile.TarInfo(name=name)
             info.size = len(data)
@@ -62,7 +64,7 @@ def test_extract_binary_rejects_traversal(tmp_path: Path) -> None:
 
 def test_extract_binary_rejects_symlinks(tmp_path: Path) -> None:
     archive_path = tmp_path / "wchisp_symlink.tar.gz"
-    with tarfile.open(archive_path, mode="w:gz") as tar:
+    with archive_path.open("wb") as fileobj, tarfile.open(fileobj=fileobj, mode="w|gz") as tar:
         info = tarfile.TarInfo(name="wchisp_link")
         info.type = tarfile.SYMTYPE
         info.linkname = "wchisp"
@@ -73,3 +75,25 @@ def test_extract_binary_rejects_symlinks(tmp_path: Path) -> None:
 
     with pytest.raises(RuntimeError, match="dangereux"):
         extract_binary(archive_path, extract_dir)
+
+
+def test_install_binary_copies_content_and_sets_exec_bits(tmp_path: Path) -> None:
+    source = tmp_path / "wchisp"
+    source.write_bytes(b"#!/bin/echo wchisp")
+    source.chmod(0o600)
+    os.utime(source, (0, 0))
+
+    destination = install_binary(source, tmp_path / "bin")
+
+    assert destination.read_bytes() == source.read_bytes()
+    assert destination.stat().st_mode & 0o111 == 0o111
+    assert destination.stat().st_mtime != 0
+
+
+def test_verify_checksum_accepts_matching_digest_and_rejects_others(tmp_path: Path) -> None:
+    archive_path = create_archive(tmp_path, [("wchisp", b"#!/bin/echo wchisp")])
+    expected = hashlib.sha256(archive_path.read_bytes()).hexdigest()
+
+    verify_checksum(archive_path, expected.upper())
+    with pytest.raises(RuntimeError, match="SHA-256"):
+        verify_checksum(archive_path, "0" * 64)
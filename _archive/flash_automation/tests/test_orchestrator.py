@@ -210,8 +210,7 @@ def test_install_python_dependencies(mock_subprocess_run, orchestrator: Orchestr
 def test_get_system_status(mock_flash_manager_class, orchestrator: Orchestrator, tmp_path: Path):
     """Vérifie que get_system_status collecte correctement l'état du système."""
     # Scénario 1: Tout est présent
-    orchestrator.klipper_dir.mkdir(parents=True)
-    (orchestrator.klipper_dir / "out").mkdir()
+    (orchestrator.klipper_dir / "out").mkdir(parents=True)
     orchestrator.firmware_path.touch()
     mock_flash_manager = MagicMock()
     mock_flash_manager.detect_serial_devices.return_value = ["/dev/ttyACM0"]
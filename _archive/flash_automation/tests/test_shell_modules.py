@@ -7,12 +7,15 @@ import shutil
 import subprocess
 import textwrap
 import time
+import types
 from pathlib import Path
 
 import pytest
 
 FLASH_DIR = Path(__file__).resolve().parents[1]
 LIB_DIR = FLASH_DIR / "lib"
+BASE_ENV = types.MappingProxyType(dict(os.environ))
+BASH_PATH = shutil.which("bash") or "/bin/bash"
 
 
 def run_shell(script: str, *, env: dict[str, str] | None = None) -> subprocess.CompletedProcess[str]:
@@ -22,18 +25,13 @@ def run_shell(script: str, *, env: dict[str, str] | None = None) -> subprocess.C
         {script}
         """
     )
-    base_env = os.environ.copy()
-    if env:
-        base_env.update(env)
-    bash_path = base_env.get("BASH", shutil.which("bash"))
-    if bash_path is None:
-        bash_path = "/bin/bash"
+    merged_env = {**BASE_ENV, **(env or {})}
     return subprocess.run(
-        [bash_path, "-c", wrapped],
+        [merged_env.get("BASH", BASH_PATH), "-c", wrapped],
         cwd=str(FLASH_DIR),
         text=True,
         capture_output=True,
-        env=base_env,
+        env=merged_env,
     )
 
 
@@ -36,10 +36,8 @@ from pathlib import Path
 # Ajoute le répertoire parent au path pour permettre les imports
 sys.path.append(str(Path(__file__).parent))
 
-from step_01_environment import main as run_step_01
-from step_02_build import main as run_step_02
-from step_03_flash import main as run_step_03
-from step_04_configure import main as run_step_04
+# Les étapes sont importées juste avant leur exécution : `--help` et
+# `--ci-check` ne chargent pas les modules dont ils n'ont pas besoin.
 import ui
 
 def main():
@@ -52,6 +50,10 @@ def main():
         "-d", "--device",
         help="Chemin vers le port série pour l'étape de flashage (ex: /dev/ttyUSB0)."
     )
+    parser.add_argument(
+        "--devices",
+        help="Ports séries séparés par des virgules pour flasher plusieurs cartes en parallèle."
+    )
     parser.add_argument(
         "--skip-flash",
         action="store_true",
@@ -74,12 +76,14 @@ def main():
         # --- Étape 1: Environnement ---
         ui.print_header("ÉTAPE 1: PRÉPARATION DE L'ENVIRONNEMENT")
         sys.argv = [original_argv[0]] # Réinitialise les arguments
+        from step_01_environment import main as run_step_01
         run_step_01()
         ui.print_success("ÉTAPE 1 TERMINÉE AVEC SUCCÈS")
 
         # --- Étape 2: Compilation ---
         ui.print_header("ÉTAPE 2: COMPILATION DU FIRMWARE")
         sys.argv = [original_argv[0]]
+        from step_02_build import main as run_step_02
         run_step_02()
         ui.print_success("ÉTAPE 2 TERMINÉE AVEC SUCCÈS")
 
@@ -94,7 +98,10 @@ def main():
             flash_args = [original_argv[0]]
             if args.device:
                 flash_args.extend(["--device", args.device])
+            if args.devices:
+                flash_args.extend(["--devices", args.devices])
             sys.argv = flash_args
+            from step_03_flash import main as run_step_03
             run_step_03()
             ui.print_success("ÉTAPE 3 TERMINÉE AVEC SUCCÈS")
         else:
@@ -103,6 +110,7 @@ def main():
         # --- Étape 4: Configuration ---
         ui.print_header("ÉTAPE 4: AIDE À LA CONFIGURATION")
         sys.argv = [original_argv[0]]
+        from step_04_configure import main as run_step_04
         run_step_04()
         ui.print_success("ÉTAPE 4 TERMINÉE AVEC SUCCÈS")
 
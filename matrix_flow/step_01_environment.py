@@ -8,28 +8,254 @@ Ce script s'assure que toutes les dépendances et les sources nécessaires
 sont en place pour les étapes de compilation et de flashage.
 """
 
+import hashlib
+import io
 import json
+import mmap
 import os
 import platform
+import queue
+import re
 import shutil
 import subprocess
 import tarfile
+import threading
+import urllib.error
 import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
 import ui
+import utils
+
+# Décompresseur gzip parallèle optionnel (pip install rapidgzip).
+try:
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
+
+# Une référence composée uniquement de chiffres hexadécimaux est traitée comme un SHA de commit
+_COMMIT_SHA_RE = re.compile(r"[0-9a-f]{7,40}")
+
+# Tampons d'extraction : lecture du flux compressé par blocs de 1 Mio et
+# copie des membres par blocs de 4 Mio (16 Kio par défaut dans tarfile).
+TAR_READ_BUFSIZE = 1024 * 1024
+TAR_COPY_BUFSIZE = 4 * 1024 * 1024
+
+# Filtre d'extraction `data` (Python 3.12, rétroporté en 3.10.12 et 3.11.4) :
+# chemins absolus, liens sortant de la destination et fichiers spéciaux refusés.
+_DATA_FILTER = getattr(tarfile, "data_filter", None)
+
+# Écriture des fichiers extraits : nombre de threads et volume maximal de
+# données lues mais pas encore écrites sur le disque.
+EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+EXTRACT_MAX_PENDING = 64 * 1024 * 1024
+
+# Lecture anticipée du téléchargement : blocs de 1 Mio, 8 blocs d'avance au plus.
+PREFETCH_CHUNK_SIZE = 1024 * 1024
+PREFETCH_DEPTH = 8
+
+# Téléchargement par plages HTTP parallèles, utilisé pour les archives d'au
+# moins 16 Mio lorsque le serveur annonce `Accept-Ranges: bytes`.
+DOWNLOAD_CONNECTIONS = 4
+RANGE_MIN_SIZE = 16 * 1024 * 1024
+
+def _sha256_file(path: Path) -> str:
+    """Calcule le SHA256 d'un fichier via mmap, sans copie en mémoire Python."""
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+    return digest.hexdigest()
+
+def _write_member(path: str, data: bytes, mode: int, mtime: int):
+    """
+    Écrit un fichier extrait en préallouant sa taille sur le disque. Un lien
+    symbolique à l'emplacement du fichier n'est jamais suivi (O_NOFOLLOW).
+    """
+    fd = os.open(path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+    try:
+        if data:
+            try:
+                os.posix_fallocate(fd, 0, len(data))
+            except OSError:
+                pass
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        os.fchmod(fd, mode)
+    finally:
+        os.close(fd)
+    os.utime(path, (mtime, mtime))
+
+def _extract_members(tar: tarfile.TarFile, dest: Path):
+    """
+    Extrait une archive lue en flux vers `dest`.
+
+    Les membres sont lus séquentiellement mais les fichiers réguliers sont
+    écrits par un pool de threads (les appels `write()` libèrent le GIL).
+    Les répertoires sont créés avant de soumettre leurs fichiers ; les autres
+    membres (liens...) sont extraits par `tarfile` une fois les écritures en
+    cours terminées, pour qu'un lien physique trouve toujours sa cible.
+
+    Chaque membre passe par le filtre `data` de tarfile lorsqu'il existe, et
+    tout membre dont le chemin réel (liens symboliques déjà extraits compris)
+    sort de `dest` est refusé ; les fichiers sont ouverts sans suivre de lien.
+    """
+    dest = Path(dest)
+    dest.mkdir(parents=True, exist_ok=True)
+    dest_real = os.path.realpath(dest)
+    extract_options = {"filter": "data"} if _DATA_FILTER is not None else {}
+    directories = []
+    pending = deque()
+    pending_bytes = 0
+
+    def wait_for(limit: int):
+        nonlocal pending_bytes
+        while pending and pending_bytes > limit:
+            future, size = pending.popleft()
+            future.result()
+            pending_bytes -= size
+
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as executor:
+        for member in tar:
+            if _DATA_FILTER is not None:
+                member = _DATA_FILTER(member, dest_real)
+            name = os.path.normpath(member.name)
+            if os.path.isabs(name) or name == ".." or name.startswith(".." + os.sep):
+                raise tarfile.TarError(f"Chemin de membre invalide : {member.name}")
+            path = dest / name
+            # Les liens symboliques sont extraits dans ce thread avant la suite :
+            # le chemin réel complet tient compte de ceux déjà présents, y
+            # compris d'un lien portant le nom même du membre.
+            if os.path.commonpath([dest_real, os.path.realpath(path)]) != dest_real:
+                raise tarfile.TarError(f"Le membre sort du répertoire de destination : {member.name}")
+            if member.isdir():
+                path.mkdir(parents=True, exist_ok=True)
+                directories.append((path, member))
+            elif member.isreg():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                data = tar.extractfile(member).read()
+                pending.append((executor.submit(_write_member, str(path), data, member.mode & 0o7777, member.mtime), len(data)))
+                pending_bytes += len(data)
+                wait_for(EXTRACT_MAX_PENDING)
+            else:
+                wait_for(-1)
+                tar.extract(member, path=dest, **extract_options)
+        wait_for(-1)
+
+    # Les attributs des répertoires sont appliqués en dernier, comme extractall().
+    # Le filtre `data` ne conserve pas le mode des répertoires (None).
+    for path, member in reversed(directories):
+        if member.mode is not None:
+            os.chmod(path, member.mode & 0o7777)
+        os.utime(path, (member.mtime, member.mtime))
+
+class _PrefetchReader:
+    """
+    Flux en lecture alimenté par un thread qui lit `source` en avance.
+
+    Le téléchargement se poursuit pendant que la décompression traite les
+    blocs précédents, au lieu d'alterner réseau et calcul.
+    """
+
+    _EOF = object()
+
+    def __init__(self, source):
+        self._source = source
+        self._queue = queue.Queue(maxsize=PREFETCH_DEPTH)
+        self._stop = threading.Event()
+        self._buffer = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fill(self):
+        try:
+            while True:
+                chunk = self._source.read(PREFETCH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if not self._put(chunk):
+                    return
+        except BaseException as e:
+            self._put(e)
+            return
+        self._put(self._EOF)
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._buffer and not self._eof:
+            item = self._queue.get()
+            if item is self._EOF:
+                self._eof = True
+            elif isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            else:
+                self._buffer = memoryview(item)
+        if size is None or size < 0:
+            parts = [bytes(self._buffer)]
+            self._buffer = memoryview(b"")
+            while not self._eof:
+                parts.append(self.read(PREFETCH_CHUNK_SIZE))
+            return b"".join(parts)
+        data = bytes(self._buffer[:size])
+        self._buffer = self._buffer[size:]
+        return data
+
+    def close(self):
+        # Le thread est un démon : il s'arrête au prochain bloc s'il est bloqué sur le réseau.
+        self._stop.set()
+
+class _HashingTee:
+    """Flux en lecture qui hache et recopie les octets lus vers `sink`."""
+
+    def __init__(self, source, sink):
+        self._source = source
+        self._sink = sink
+        self._digest = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._source.read(size)
+        if data:
+            self._digest.update(data)
+            self._sink.write(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+class _BufferedOutput:
+    """Met en attente les messages d'une tâche d'arrière-plan pour les afficher d'un bloc."""
+
+    def __init__(self):
+        self._messages = []
+
+    def print_info(self, text: str):
+        self._messages.append((ui.print_info, text))
+
+    def print_success(self, text: str):
+        self._messages.append((ui.print_success, text))
+
+    def replay(self):
+        for printer, text in self._messages:
+            printer(text)
 
 class EnvironmentError(Exception):
     """Exception personnalisée pour les erreurs de cette étape."""
     pass
 
-class TqdmUpTo(tqdm):
-    """Provides `update_to(block_num, block_size, total_size)`."""
-    def update_to(self, b=1, bsize=1, tsize=None):
-        if tsize is not None:
-            self.total = tsize
-        self.update(b * bsize - self.n)
-
 class EnvironmentManager:
     """Gère la préparation de l'environnement."""
 
@@ -40,19 +266,22 @@ class EnvironmentManager:
         self.klipper_dir = self.cache_dir / "klipper"
         self._load_config()
         self.toolchain_dir = self.cache_dir / self.config["toolchain"]["subdirectory"]
+        # Décompresseur gzip multi-thread optionnel, détecté une seule fois
+        self._pigz_path = utils.which("pigz")
+        self.archives_dir = self.cache_dir / "archives"
+        self.archive_index_path = self.archives_dir / "index.json"
 
     def _load_config(self):
         """Charge la configuration depuis config.json."""
         try:
-            with self.config_path.open("r", encoding="utf-8") as f:
-                self.config = json.load(f)
+            self.config = utils.load_config(self.config_path)
         except (FileNotFoundError, json.JSONDecodeError) as e:
             raise EnvironmentError(f"Le fichier de configuration '{self.config_path}' est manquant ou invalide.") from e
 
     def _run_command(self, command: list[str], cwd: Path):
         """Exécute une commande et lève une exception en cas d'échec."""
         try:
-            subprocess.run(
+            return subprocess.run(
                 command,
                 cwd=cwd,
                 check=True,
@@ -71,81 +300,337 @@ class EnvironmentManager:
             )
             raise EnvironmentError(error_message) from e
 
+    def _update_submodules(self):
+        """Initialise les sous-modules éventuels, en parallèle."""
+        if not (self.klipper_dir / ".gitmodules").is_file():
+            return
+        jobs = str(os.cpu_count() or 4)
+        self._run_command(
+            ["git", "submodule", "update", "--init", "--recursive", "--depth", "1", "--jobs", jobs],
+            cwd=self.klipper_dir,
+        )
+
     def check_system_dependencies(self):
         """Vérifie la présence des dépendances système de base."""
         ui.print_info("Vérification des dépendances système...")
         dependencies = ["git", "make", "python3"]
-        missing = [dep for dep in dependencies if not shutil.which(dep)]
+        missing = [dep for dep in dependencies if not utils.which(dep)]
         if missing:
             raise EnvironmentError(f"Dépendances système manquantes : {', '.join(missing)}. Veuillez les installer.")
         ui.print_success("Dépendances système OK.")
 
-    def ensure_klipper_repo(self):
-        """S'assure que le dépôt Klipper est cloné et à la bonne version."""
+    def ensure_klipper_repo(self, output=ui):
+        """
+        S'assure que le dépôt Klipper est cloné et à la bonne version.
+
+        Les messages passent par `output` (le module `ui` par défaut), qui
+        peut les mettre en attente lorsque la méthode tourne en arrière-plan.
+        """
         klipper_config = self.config["klipper"]
         repo_url = klipper_config["repository_url"]
         git_ref = klipper_config["git_ref"]
 
-        if not self.klipper_dir.is_dir() or not (self.klipper_dir / ".git").is_dir():
-            ui.print_info(f"Clonage de Klipper (version {git_ref})...")
+        # Seul l'arbre de travail de la référence cible est utile à la compilation :
+        # clone superficiel pour une branche/un tag, clone partiel pour un SHA.
+        is_commit_sha = _COMMIT_SHA_RE.fullmatch(git_ref) is not None
+
+        # Un seul stat : `.git` présent implique que le répertoire de Klipper existe.
+        if not (self.klipper_dir / ".git").is_dir():
+            output.print_info(f"Clonage de Klipper (version {git_ref})...")
             self.cache_dir.mkdir(exist_ok=True)
-            self._run_command(["git", "clone", "--branch", git_ref, repo_url, str(self.klipper_dir)], cwd=self.cache_dir)
+            if is_commit_sha:
+                self._run_command(["git", "clone", "--filter=blob:none", "--no-checkout", repo_url, str(self.klipper_dir)], cwd=self.cache_dir)
+                self._run_command(["git", "checkout", git_ref], cwd=self.klipper_dir)
+            else:
+                self._run_command(["git", "clone", "--depth", "1", "--single-branch", "--branch", git_ref, "--no-tags", repo_url, str(self.klipper_dir)], cwd=self.cache_dir)
         else:
-            ui.print_info(f"Vérification du dépôt Klipper (cible: {git_ref})...")
-            self._run_command(["git", "fetch", "origin", "--tags"], cwd=self.klipper_dir)
-            self._run_command(["git", "checkout", git_ref], cwd=self.klipper_dir)
-        ui.print_success("Dépôt Klipper OK.")
+            output.print_info(f"Vérification du dépôt Klipper (cible: {git_ref})...")
+            if is_commit_sha:
+                self._run_command(["git", "fetch", "--filter=blob:none", "origin", git_ref], cwd=self.klipper_dir)
+            else:
+                self._run_command(["git", "fetch", "--depth", "1", "origin", git_ref], cwd=self.klipper_dir)
+            self._run_command(["git", "checkout", "FETCH_HEAD"], cwd=self.klipper_dir)
+        self._update_submodules()
+        output.print_success("Dépôt Klipper OK.")
 
-    def ensure_toolchain(self):
-        """S'assure que la toolchain RISC-V est téléchargée et extraite."""
-        if self.toolchain_dir.is_dir():
-            ui.print_info("La toolchain RISC-V est déjà présente.")
+    def _extract_archive(self, stream, dest: Path):
+        """Extrait une archive .tar.gz lue en flux vers `dest`.
+
+        Pour une archive déjà sur le disque, le module optionnel `rapidgzip`
+        décompresse en parallèle. Sinon, si `pigz` est disponible, la
+        décompression gzip est déléguée à ce processus multi-thread ; `tarfile`
+        ne fait alors que dépaqueter.
+        """
+        if rapidgzip is not None and isinstance(stream, io.BufferedReader):
+            with rapidgzip.open(stream.name, parallelization=os.cpu_count() or 1) as decompressed:
+                with tarfile.open(fileobj=decompressed, mode="r|", bufsize=TAR_READ_BUFSIZE, copybufsize=TAR_COPY_BUFSIZE) as tar:
+                    _extract_members(tar, dest)
             return
 
-        ui.print_info("Téléchargement de la toolchain RISC-V...")
-        self.cache_dir.mkdir(exist_ok=True)
-        archive_path = self.cache_dir / "riscv-toolchain.tar.gz"
+        if not self._pigz_path:
+            with tarfile.open(fileobj=stream, mode="r|gz", bufsize=TAR_READ_BUFSIZE, copybufsize=TAR_COPY_BUFSIZE) as tar:
+                _extract_members(tar, dest)
+            return
+
+        process = subprocess.Popen(
+            [self._pigz_path, "-dc"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=TAR_READ_BUFSIZE,
+        )
+        feed_errors: list[BaseException] = []
+
+        def feed():
+            try:
+                shutil.copyfileobj(stream, process.stdin, TAR_READ_BUFSIZE)
+            except BrokenPipeError:
+                pass
+            except BaseException as e:
+                feed_errors.append(e)
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        try:
+            with tarfile.open(fileobj=process.stdout, mode="r|", bufsize=TAR_READ_BUFSIZE, copybufsize=TAR_COPY_BUFSIZE) as tar:
+                _extract_members(tar, dest)
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            feeder.join()
+            returncode = process.wait()
+        if feed_errors:
+            raise feed_errors[0]
+        if returncode != 0:
+            raise tarfile.TarError(f"pigz a échoué (code {returncode}).")
+
+    def _links_to(self, name: str) -> bool:
+        """Indique si `toolchain_dir` est un lien vers le dossier `name` du cache, toujours présent."""
+        try:
+            return os.readlink(self.toolchain_dir) == name and self.toolchain_dir.is_dir()
+        except OSError:
+            return False
 
+    def _link_toolchain(self, target: Path):
+        """
+        Fait pointer `toolchain_dir` vers une toolchain extraite du cache. Un
+        ancien dossier réel (antérieur au cache) est remplacé par le lien.
+        """
+        if self.toolchain_dir.is_symlink():
+            self.toolchain_dir.unlink()
+        elif self.toolchain_dir.is_dir():
+            shutil.rmtree(self.toolchain_dir)
+        os.symlink(target.name, self.toolchain_dir, target_is_directory=True)
+
+    def _load_archive_index(self) -> dict:
+        """Charge l'index URL -> SHA256 des archives déjà téléchargées."""
+        try:
+            with self.archive_index_path.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_archive_index(self, index: dict):
+        """Enregistre l'index des archives téléchargées."""
+        with self.archive_index_path.open("w", encoding="utf-8") as f:
+            json.dump(index, f, indent=2)
+
+    def ensure_toolchain(self):
+        """
+        S'assure que la toolchain RISC-V correspondant à l'URL de config.json
+        est téléchargée, extraite et désignée par `toolchain_dir`.
+        """
         machine_arch = platform.machine()
         if machine_arch not in self.config["toolchain"]["urls"]:
             raise EnvironmentError(f"L'architecture machine '{machine_arch}' n'est pas supportée. Architectures disponibles : {', '.join(self.config['toolchain']['urls'].keys())}")
-
         toolchain_url = self.config["toolchain"]["urls"][machine_arch]
+
+        # Les archives et les toolchains extraites sont adressées par leur SHA256 :
+        # une empreinte déjà vue pour cette URL permet de réutiliser le cache
+        # sans rien retélécharger. Le lien n'est conservé que s'il désigne
+        # déjà la toolchain de cette URL ; sinon il est déplacé.
+        archive_index = self._load_archive_index()
+        known_sha256 = archive_index.get(toolchain_url)
+        if known_sha256 and self._links_to(f"toolchain-{known_sha256[:8]}"):
+            ui.print_info("La toolchain RISC-V est déjà présente.")
+            return
+
+        self.cache_dir.mkdir(exist_ok=True)
+        self.archives_dir.mkdir(exist_ok=True)
         ui.print_info(f"Détection de l'architecture : {machine_arch}. Utilisation de l'URL : {toolchain_url}")
 
-        try:
-            with TqdmUpTo(unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
-                          desc=archive_path.name) as t:
-                urllib.request.urlretrieve(toolchain_url, filename=archive_path, reporthook=t.update_to)
-        except Exception as e:
-            raise EnvironmentError(f"Échec du téléchargement de la toolchain : {e}") from e
+        temp_extract_dir = self.cache_dir / "temp_toolchain_extract"
+        if temp_extract_dir.exists():
+            shutil.rmtree(temp_extract_dir)
+        partial_path = self.archives_dir / "download.part"
 
-        ui.print_info(f"Extraction de l'archive vers {self.toolchain_dir}...")
         try:
-            with tarfile.open(archive_path, "r:gz") as tar:
-                temp_extract_dir = self.cache_dir / "temp_toolchain_extract"
-                tar.extractall(path=temp_extract_dir)
+            if known_sha256:
+                extracted_dir = self.cache_dir / f"toolchain-{known_sha256[:8]}"
+                if extracted_dir.is_dir():
+                    ui.print_info(f"Toolchain trouvée dans le cache ({extracted_dir.name}).")
+                    self._link_toolchain(extracted_dir)
+                    ui.print_success("Toolchain RISC-V OK.")
+                    return
 
-                extracted_dirs = list(temp_extract_dir.iterdir())
-                if not extracted_dirs:
-                    raise EnvironmentError("L'archive de la toolchain est vide.")
+                archive_path = self.archives_dir / f"{known_sha256}.tar.gz"
+                if archive_path.is_file() and _sha256_file(archive_path) == known_sha256:
+                    ui.print_info(f"Extraction de l'archive en cache vers {self.toolchain_dir}...")
+                    with archive_path.open("rb") as stream:
+                        self._extract_archive(stream, temp_extract_dir)
+                    self._install_extracted(temp_extract_dir, extracted_dir)
+                    ui.print_success("Toolchain RISC-V OK.")
+                    return
 
-                shutil.move(str(extracted_dirs[0]), str(self.toolchain_dir))
-                shutil.rmtree(temp_extract_dir)
+            ui.print_info("Téléchargement de la toolchain RISC-V...")
+            ranged = self._probe_range_support(toolchain_url)
+            if ranged:
+                final_url, total_size = ranged
+                self._download_ranges(final_url, total_size, partial_path)
+                actual_sha256 = _sha256_file(partial_path)
+                ui.print_info(f"Extraction de l'archive vers {self.toolchain_dir}...")
+                with partial_path.open("rb") as stream:
+                    self._extract_archive(stream, temp_extract_dir)
+            else:
+                ui.print_info(f"Extraction de l'archive vers {self.toolchain_dir}...")
+                actual_sha256 = self._download_streaming(toolchain_url, partial_path, temp_extract_dir)
 
+            os.replace(partial_path, self.archives_dir / f"{actual_sha256}.tar.gz")
+            archive_index[toolchain_url] = actual_sha256
+            self._save_archive_index(archive_index)
+            self._install_extracted(temp_extract_dir, self.cache_dir / f"toolchain-{actual_sha256[:8]}")
         except tarfile.TarError as e:
             raise EnvironmentError(f"Échec de l'extraction de l'archive de la toolchain : {e}") from e
+        except EnvironmentError:
+            raise
+        except Exception as e:
+            raise EnvironmentError(f"Échec du téléchargement de la toolchain : {e}") from e
         finally:
-            if archive_path.exists():
-                archive_path.unlink()
+            if temp_extract_dir.exists():
+                shutil.rmtree(temp_extract_dir)
+            if partial_path.exists():
+                partial_path.unlink()
 
         ui.print_success("Toolchain RISC-V OK.")
 
+    def _download_streaming(self, url: str, partial_path: Path, dest: Path) -> str:
+        """
+        Télécharge l'archive sur une seule connexion en l'extrayant à la volée
+        vers `dest` et en la recopiant dans `partial_path`. Retourne son SHA256.
+        """
+        with urllib.request.urlopen(url) as response, partial_path.open("wb") as sink:
+            total_size = int(response.headers.get("Content-Length") or 0) or None
+            with tqdm.wrapattr(response, "read", total=total_size, desc="riscv-toolchain.tar.gz") as stream:
+                prefetch = _PrefetchReader(stream)
+                try:
+                    tee = _HashingTee(prefetch, sink)
+                    self._extract_archive(tee, dest)
+                    # tarfile s'arrête au marqueur de fin d'archive : on lit le
+                    # reste (bourrage, en-queue gzip) pour que la copie soit complète.
+                    while tee.read(TAR_READ_BUFSIZE):
+                        pass
+                finally:
+                    prefetch.close()
+        return tee.hexdigest()
+
+    @staticmethod
+    def _probe_range_support(url: str) -> tuple[str, int] | None:
+        """
+        Interroge le serveur (requête HEAD, redirections suivies) et retourne
+        l'URL finale et la taille de l'archive si elle peut être téléchargée
+        par plages, `None` sinon.
+        """
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, method="HEAD")) as response:
+                size = int(response.headers.get("Content-Length") or 0)
+                if response.headers.get("Accept-Ranges", "").lower() != "bytes" or size < RANGE_MIN_SIZE:
+                    return None
+                return response.geturl(), size
+        except (urllib.error.URLError, OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _download_ranges(url: str, total_size: int, partial_path: Path):
+        """
+        Télécharge l'archive en `DOWNLOAD_CONNECTIONS` plages parallèles,
+        chacune écrite à sa position dans `partial_path` avec `os.pwrite`.
+        """
+        chunk = -(-total_size // DOWNLOAD_CONNECTIONS)
+        ranges = [(start, min(start + chunk, total_size) - 1) for start in range(0, total_size, chunk)]
+        progress_lock = threading.Lock()
+
+        fd = os.open(partial_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, total_size)
+            with tqdm(total=total_size, unit="B", unit_scale=True, desc="riscv-toolchain.tar.gz") as progress:
+
+                def fetch(start: int, end: int):
+                    request = urllib.request.Request(url, headers={"Range": f"bytes={start}-{end}"})
+                    with urllib.request.urlopen(request) as response:
+                        if response.status != 206:
+                            raise EnvironmentError(f"Le serveur a ignoré la requête de plage (HTTP {response.status}).")
+                        offset = start
+                        while data := response.read(TAR_READ_BUFSIZE):
+                            os.pwrite(fd, data, offset)
+                            offset += len(data)
+                            with progress_lock:
+                                progress.update(len(data))
+                    if offset != end + 1:
+                        raise EnvironmentError(f"Plage {start}-{end} incomplète ({offset - start} octets reçus).")
+
+                with ThreadPoolExecutor(max_workers=DOWNLOAD_CONNECTIONS) as executor:
+                    futures = [executor.submit(fetch, start, end) for start, end in ranges]
+                    for future in futures:
+                        future.result()
+        finally:
+            os.close(fd)
+
+    def _install_extracted(self, temp_extract_dir: Path, extracted_dir: Path):
+        """Déplace la toolchain extraite dans le cache et y relie `toolchain_dir`."""
+        extracted_dirs = list(temp_extract_dir.iterdir()) if temp_extract_dir.is_dir() else []
+        if not extracted_dirs:
+            raise EnvironmentError("L'archive de la toolchain est vide.")
+        if extracted_dir.exists():
+            shutil.rmtree(extracted_dir)
+        shutil.move(str(extracted_dirs[0]), str(extracted_dir))
+        self._link_toolchain(extracted_dir)
+
     def run(self):
         """Exécute toutes les étapes de préparation."""
         self.check_system_dependencies()
-        self.ensure_klipper_repo()
-        self.ensure_toolchain()
+
+        # Le clonage de Klipper (sous-processus git) avance en arrière-plan
+        # pendant que la toolchain est téléchargée dans le thread principal :
+        # Ctrl-C interrompt directement le téléchargement, et les messages de
+        # git sont affichés d'un bloc une fois la toolchain prête.
+        repo_output = _BufferedOutput()
+        executor = ThreadPoolExecutor(max_workers=1)
+        repo_future = executor.submit(self.ensure_klipper_repo, repo_output)
+        errors = []
+        try:
+            try:
+                self.ensure_toolchain()
+            except Exception as e:
+                errors.append(e)
+            repo_error = repo_future.exception()
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+        repo_output.replay()
+        if repo_error is not None:
+            errors.insert(0, repo_error)
+        if len(errors) == 1:
+            raise errors[0]
+        if errors:
+            raise EnvironmentError("\n".join(str(error) for error in errors)) from errors[0]
 
 
 def main():
@@ -8,16 +8,60 @@ Ce script utilise l'environnement préparé par l'étape 1 pour compiler
 le firmware Klipper pour la carte BMCU-C.
 """
 
+import fcntl
+import hashlib
 import json
 import os
+import selectors
 import shutil
 import subprocess
 import sys
 import threading
 import itertools
 import time
+from collections import deque
 from pathlib import Path
 import ui
+import utils
+
+# Nombre de lignes conservées par flux (stdout/stderr) pour les messages d'erreur.
+OUTPUT_TAIL_LINES = 500
+# Taille des lectures sur les tubes de la commande.
+OUTPUT_READ_SIZE = 1 << 16
+# ioctl Linux de clonage copy-on-write d'un fichier (reflink btrfs/xfs).
+FICLONE = 0x40049409
+
+def _clone_file(src: str, dst: str):
+    """
+    Place une copie de `src` en `dst` sans dupliquer les données si possible :
+    lien physique, puis reflink, puis copie classique en dernier recours.
+    Lève `BuildError` si même la copie classique échoue.
+    """
+    try:
+        if os.path.samefile(src, dst):
+            return
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        raise BuildError(f"Impossible de remplacer '{dst}' : {e}") from e
+    # Toute erreur des voies rapides (EXDEV, EPERM, EACCES, ENOTSUP...) mène à la copie.
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        shutil.copy2(src, dst)
+    except OSError as e:
+        raise BuildError(f"Impossible de copier '{src}' vers '{dst}' : {e}") from e
 
 class BuildError(Exception):
     """Exception personnalisée pour les erreurs de cette étape."""
@@ -36,28 +80,47 @@ class BuildManager:
         self._load_config()
         self.toolchain_dir = self.cache_dir / self.config["toolchain"]["subdirectory"]
         self.firmware_path = self.klipper_dir / "out/klipper.bin"
+        self.build_state_path = self.cache_dir / "last_build.json"
+        self.overrides_manifest_path = self.cache_dir / "overrides.manifest"
+        self.ccache_dir = self.cache_dir / "ccache"
+        self.ccache_bin_dir = self.cache_dir / "ccache-bin"
+        self._ccache_path = utils.which("ccache")
+        self._subprocess_env = None
 
     def _load_config(self):
         """Charge la configuration depuis config.json."""
         try:
-            with self.config_path.open("r", encoding="utf-8") as f:
-                self.config = json.load(f)
+            self.config = utils.load_config(self.config_path)
         except (FileNotFoundError, json.JSONDecodeError) as e:
             raise BuildError(f"Le fichier de configuration '{self.config_path}' est manquant ou invalide.") from e
 
-    def _run_command_with_spinner(self, command: list[str], cwd: Path, title: str):
-        """Exécute une commande avec un spinner et lève une exception en cas d'échec."""
-        env = os.environ.copy()
+    def _get_subprocess_env(self) -> dict:
+        """
+        Construit une seule fois l'environnement des commandes de compilation :
+        toolchain (et ccache le cas échéant) en tête du PATH.
+        """
+        if self._subprocess_env is not None:
+            return self._subprocess_env
         toolchain_bin = self.toolchain_dir.resolve() / "bin"
         if not toolchain_bin.is_dir():
             raise BuildError(f"Le répertoire bin de la toolchain '{toolchain_bin}' est introuvable. Avez-vous exécuté l'étape 1 ?")
+        env = os.environ.copy()
         env["PATH"] = f"{str(toolchain_bin)}{os.pathsep}{env['PATH']}"
+        if self._ccache_path:
+            self._prepare_ccache(toolchain_bin)
+            env["PATH"] = f"{str(self.ccache_bin_dir)}{os.pathsep}{env['PATH']}"
+            env["CCACHE_DIR"] = str(self.ccache_dir)
+            env["CCACHE_MAXSIZE"] = "500M"
+        self._subprocess_env = env
+        return env
+
+    def _run_command_with_spinner(self, command: list[str], cwd: Path, title: str):
+        """Exécute une commande avec un spinner et lève une exception en cas d'échec."""
+        env = self._get_subprocess_env()
 
         spinner = itertools.cycle(['-', '/', '|', '\\'])
         done = threading.Event()
 
-        process = None
-
         def spin():
             while not done.is_set():
                 sys.stdout.write(f'\r{title} {next(spinner)}')
@@ -70,30 +133,84 @@ class BuildManager:
         spinner_thread.start()
 
         try:
-            process = subprocess.run(
-                command,
-                cwd=cwd,
-                check=True,
-                capture_output=True,
-                text=True,
-                encoding="utf-8",
-                errors="replace",
-                env=env,
-            )
-            return process
+            stdout, stderr, returncode = self._stream_command(command, cwd, env)
         except FileNotFoundError as e:
             raise BuildError(f"La commande '{command[0]}' est introuvable. Est-elle installée ?") from e
-        except subprocess.CalledProcessError as e:
-            error_message = (
-                f"La commande `{' '.join(command)}` a échoué (code {e.returncode}).\n"
-                f"--- STDOUT ---\n{e.stdout}\n"
-                f"--- STDERR ---\n{e.stderr}"
-            )
-            raise BuildError(error_message) from e
         finally:
             done.set()
             spinner_thread.join()
 
+        if returncode != 0:
+            error_message = (
+                f"La commande `{' '.join(command)}` a échoué (code {returncode}).\n"
+                f"--- STDOUT (dernières lignes) ---\n{stdout}\n"
+                f"--- STDERR (dernières lignes) ---\n{stderr}"
+            )
+            raise BuildError(error_message)
+        return subprocess.CompletedProcess(command, returncode, stdout, stderr)
+
+    @staticmethod
+    def _stream_command(command: list[str], cwd: Path, env: dict) -> tuple[str, str, int]:
+        """
+        Exécute une commande en lisant stdout et stderr au fil de l'eau.
+
+        Seules les `OUTPUT_TAIL_LINES` dernières lignes de chaque flux sont
+        conservées, ce qui borne la mémoire utilisée quelle que soit la
+        verbosité de la compilation.
+        """
+        process = subprocess.Popen(
+            command,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=OUTPUT_READ_SIZE,
+            env=env,
+        )
+        tails = {process.stdout: deque(maxlen=OUTPUT_TAIL_LINES), process.stderr: deque(maxlen=OUTPUT_TAIL_LINES)}
+        pending = {process.stdout: b"", process.stderr: b""}
+        try:
+            with selectors.DefaultSelector() as selector:
+                for stream in tails:
+                    selector.register(stream, selectors.EVENT_READ)
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        stream = key.fileobj
+                        chunk = stream.read1(OUTPUT_READ_SIZE)
+                        if not chunk:
+                            selector.unregister(stream)
+                            if pending[stream]:
+                                tails[stream].append(pending[stream])
+                            continue
+                        lines = (pending[stream] + chunk).split(b"\n")
+                        pending[stream] = lines.pop()
+                        tails[stream].extend(lines)
+            returncode = process.wait()
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            process.stdout.close()
+            process.stderr.close()
+
+        def decode(stream):
+            return b"\n".join(tails[stream]).decode("utf-8", errors="replace")
+
+        return decode(process.stdout), decode(process.stderr), returncode
+
+    def _prepare_ccache(self, toolchain_bin: Path):
+        """
+        Crée des liens `riscv-none-elf-gcc -> ccache` placés avant la toolchain
+        dans le PATH. Le Makefile de Klipper fixe lui-même `CC`, ccache est donc
+        injecté par le PATH plutôt que par la variable d'environnement.
+        """
+        self.ccache_bin_dir.mkdir(parents=True, exist_ok=True)
+        with os.scandir(toolchain_bin) as entries:
+            compilers = [entry.name for entry in entries if entry.name.endswith(("-gcc", "-g++"))]
+        for name in compilers:
+            link = self.ccache_bin_dir / name
+            if not link.is_symlink():
+                link.symlink_to(self._ccache_path)
 
     def _apply_overrides(self):
         """Applique les fichiers et patchs spécifiques au projet."""
@@ -102,28 +219,142 @@ class BuildManager:
             ui.print_warning("Le répertoire des surcharges n'a pas été trouvé.")
             return
 
-        shutil.copytree(self.overrides_dir, self.klipper_dir, dirs_exist_ok=True)
+        applied = self._link_tree(self.overrides_dir, self.klipper_dir)
+        self._remove_stale_overrides(applied)
+        self.overrides_manifest_path.write_text("\n".join(sorted(applied)) + "\n", encoding="utf-8")
         ui.print_success("Surcharges appliquées.")
 
+    @staticmethod
+    def _link_tree(src: Path, dst: Path) -> set[str]:
+        """
+        Reproduit l'arborescence `src` dans `dst` via `_clone_file` et retourne
+        les chemins relatifs des fichiers placés.
+        """
+        applied = set()
+        pending = [""]
+        while pending:
+            relative_dir = pending.pop()
+            os.makedirs(dst / relative_dir, exist_ok=True)
+            with os.scandir(src / relative_dir) as entries:
+                for entry in entries:
+                    relative = os.path.join(relative_dir, entry.name)
+                    if entry.is_dir():
+                        pending.append(relative)
+                    else:
+                        _clone_file(entry.path, str(dst / relative))
+                        applied.add(relative)
+        return applied
+
+    def _remove_stale_overrides(self, applied: set[str]):
+        """
+        Supprime de Klipper les surcharges appliquées lors d'une précédente
+        exécution mais retirées depuis de `klipper_overrides/`, en restaurant
+        la version suivie par git lorsqu'elle existe.
+        """
+        try:
+            previous = set(self.overrides_manifest_path.read_text(encoding="utf-8").split())
+        except FileNotFoundError:
+            return
+        for relative in sorted(previous - applied):
+            try:
+                (self.klipper_dir / relative).unlink()
+            except FileNotFoundError:
+                pass
+            subprocess.run(["git", "checkout", "HEAD", "--", relative], cwd=self.klipper_dir, capture_output=True)
+
+    def _git_head(self) -> str:
+        """Retourne le SHA du commit courant de Klipper, ou une chaîne vide."""
+        try:
+            result = subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                cwd=self.klipper_dir,
+                capture_output=True,
+                text=True,
+            )
+        except FileNotFoundError:
+            return ""
+        return result.stdout.strip() if result.returncode == 0 else ""
+
+    def _hash_overrides(self, hasher):
+        """Ajoute à `hasher` le chemin, la taille et la date de chaque surcharge."""
+        if not self.overrides_dir.is_dir():
+            return
+        pending = [self.overrides_dir]
+        while pending:
+            with os.scandir(pending.pop()) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(Path(entry.path))
+                        continue
+                    stat = entry.stat()
+                    relative = os.path.relpath(entry.path, self.overrides_dir)
+                    hasher.update(f"{relative}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+
+    def _compute_fingerprints(self, toolchain: str) -> tuple[str, str]:
+        """
+        Calcule l'empreinte de la configuration Klipper et celle de l'ensemble
+        des entrées de la compilation (configuration, commit, surcharges,
+        toolchain résolue `toolchain`).
+        """
+        config_sha = hashlib.sha256(self.default_kconfig_path.read_bytes()).hexdigest()
+        hasher = hashlib.sha256()
+        hasher.update(config_sha.encode())
+        hasher.update(self._git_head().encode())
+        self._hash_overrides(hasher)
+        hasher.update(toolchain.encode())
+        return config_sha, hasher.hexdigest()
+
+    def _load_build_state(self) -> dict:
+        """Lit l'état de la dernière compilation réussie (vide si absent ou invalide)."""
+        try:
+            with open(self.build_state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _save_build_state(self, config_sha: str, fingerprint: str, toolchain: str):
+        """Mémorise les empreintes et la toolchain de la compilation qui vient de réussir."""
+        state = {
+            "config_sha256": config_sha,
+            "fingerprint": fingerprint,
+            "toolchain": toolchain,
+            "firmware": str(self.firmware_path),
+        }
+        self.build_state_path.write_text(json.dumps(state, indent=2), encoding="utf-8")
+
     def run(self):
         """Exécute toutes les étapes de la compilation."""
         if not self.klipper_dir.is_dir():
             raise BuildError("Le répertoire de Klipper est introuvable. Avez-vous exécuté l'étape 1 ?")
 
-        self._apply_overrides()
-
         ui.print_info(f"Utilisation de la configuration : {self.default_kconfig_path}")
         if not self.default_kconfig_path.is_file():
             raise BuildError(f"Le fichier de configuration '{self.default_kconfig_path}' est introuvable.")
+
+        # Chemin résolu de la toolchain (`toolchain-<sha8>`) : identifie sa version.
+        toolchain = str(self.toolchain_dir.resolve())
+        config_sha, fingerprint = self._compute_fingerprints(toolchain)
+        previous = self._load_build_state()
+        if previous.get("fingerprint") == fingerprint and self.firmware_path.is_file():
+            ui.print_success(f"Sources inchangées depuis la dernière compilation, firmware réutilisé : {self.firmware_path}")
+            return self.firmware_path
+
+        self._apply_overrides()
         shutil.copy(self.default_kconfig_path, self.klipper_dir / ".config")
 
         self._run_command_with_spinner(["make", "olddefconfig"], cwd=self.klipper_dir, title="Préparation de la configuration Klipper...")
         ui.print_success("Configuration Klipper préparée.")
 
-        self._run_command_with_spinner(["make", "clean"], cwd=self.klipper_dir, title="Nettoyage de l'environnement de compilation...")
-        ui.print_success("Environnement de compilation nettoyé.")
+        # Les objets compilés par une autre toolchain ne doivent pas être réutilisés.
+        if previous.get("config_sha256") != config_sha or previous.get("toolchain") != toolchain:
+            self._run_command_with_spinner(["make", "clean"], cwd=self.klipper_dir, title="Nettoyage de l'environnement de compilation...")
+            ui.print_success("Environnement de compilation nettoyé.")
+        else:
+            ui.print_info("Configuration et toolchain inchangées : compilation incrémentale.")
 
-        make_process = self._run_command_with_spinner(["make"], cwd=self.klipper_dir, title="Compilation du firmware...")
+        jobs = os.cpu_count() or 4
+        make_command = ["make", f"-j{jobs}", f"-l{jobs}", "--output-sync=recurse"]
+        make_process = self._run_command_with_spinner(make_command, cwd=self.klipper_dir, title="Compilation du firmware...")
 
         if not self.firmware_path.is_file():
             error_details = (
@@ -133,6 +364,7 @@ class BuildManager:
             )
             raise BuildError(error_details)
 
+        self._save_build_state(config_sha, fingerprint, toolchain)
         ui.print_success(f"Firmware compilé avec succès : {self.firmware_path}")
         return self.firmware_path
 
@@ -7,13 +7,33 @@ MatrixFlow - Étape 3 : Flashage du firmware.
 Ce script prend le firmware compilé et le téléverse sur la carte BMCU-C.
 """
 
-import glob
 import os
-import shutil
+import stat
 import subprocess
-import sys
+from collections import deque
 from pathlib import Path
 import ui
+import utils
+
+# Emplacements parcourus pour la détection automatique des ports série.
+SERIAL_BY_ID_DIR = "/dev/serial/by-id"
+DEV_DIR = "/dev"
+SERIAL_DEVICE_PREFIXES = ("ttyUSB", "ttyACM", "ttyCH")
+# Répertoires où systemd cherche les unités installées.
+SYSTEMD_UNIT_DIRS = ("/etc/systemd/system", "/lib/systemd/system", "/usr/lib/systemd/system")
+KLIPPER_SERVICE = "klipper.service"
+
+# Nombre de lignes de sortie d'une commande conservées pour les messages d'erreur.
+OUTPUT_TAIL_LINES = 200
+# Taille des lectures sur la sortie des commandes.
+OUTPUT_READ_SIZE = 1 << 16
+
+def _is_char_device(entry: os.DirEntry, follow_symlinks: bool) -> bool:
+    """Indique si l'entrée désigne un périphérique caractère existant."""
+    try:
+        return stat.S_ISCHR(entry.stat(follow_symlinks=follow_symlinks).st_mode)
+    except OSError:
+        return False
 
 class FlashError(Exception):
     """Exception personnalisée pour les erreurs de cette étape."""
@@ -26,110 +46,227 @@ class FlashManager:
         self.base_dir = base_dir
         self.klipper_dir = self.base_dir / ".cache/klipper"
         self.firmware_path = self.klipper_dir / "out/klipper.bin"
-
-    def _run_command(self, command: list[str], ignore_errors: bool = False):
-        """Exécute une commande et gère les erreurs."""
-        env = os.environ.copy()
+        # Environnement des commandes, construit une fois : `bin/` du projet en tête du PATH.
+        self._subprocess_env = os.environ.copy()
         bin_dir = self.base_dir / "bin"
-        env["PATH"] = f"{str(bin_dir.resolve())}{os.pathsep}{env['PATH']}"
+        self._subprocess_env["PATH"] = f"{str(bin_dir.resolve())}{os.pathsep}{self._subprocess_env['PATH']}"
+        # Outils résolus une seule fois.
+        self._wchisp = utils.which("wchisp", self._subprocess_env["PATH"])
+        self._sudo = utils.which("sudo")
+        # Sans unité klipper.service, inutile de lancer sudo systemctl.
+        self._has_klipper_service = any(os.path.exists(os.path.join(d, KLIPPER_SERVICE)) for d in SYSTEMD_UNIT_DIRS)
+
+    async def _run_command(self, command: list[str], ignore_errors: bool = False, label: str | None = None):
+        """
+        Exécute une commande de façon asynchrone et gère les erreurs. Les
+        lignes relayées sont préfixées par `label` (le port série lors d'un
+        flashage) pour distinguer les sorties entremêlées de plusieurs cartes.
+        """
+        import asyncio
+        env = self._subprocess_env
+        output_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+        prefix = f"[{label}] " if label else ""
+
+        def relay(raw: bytes):
+            line = raw.decode("utf-8", errors="replace").rstrip("\r")
+            if line:
+                output_tail.append(line)
+                ui.print_info(prefix + line)
+
         try:
-            subprocess.run(
-                command,
-                check=True,
-                capture_output=True,
-                text=True,
-                encoding="utf-8",
-                errors="replace",
+            # La sortie est relayée au fil de l'eau ; seules les dernières
+            # lignes sont conservées pour le message d'erreur.
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
                 env=env,
             )
+            pending = b""
+            while chunk := await process.stdout.read(OUTPUT_READ_SIZE):
+                *lines, pending = (pending + chunk).split(b"\n")
+                for raw in lines:
+                    relay(raw)
+            relay(pending)
+            returncode = await process.wait()
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, command, output="\n".join(output_tail))
         except (FileNotFoundError, subprocess.CalledProcessError) as e:
             if not ignore_errors:
                 error_message = (
                     f"La commande `{' '.join(command)}` a échoué.\n"
-                    f"--- STDOUT ---\n{e.stdout if isinstance(e, subprocess.CalledProcessError) else ''}\n"
-                    f"--- STDERR ---\n{e.stderr if isinstance(e, subprocess.CalledProcessError) else ''}"
+                    f"--- SORTIE (dernières lignes) ---\n{e.output if isinstance(e, subprocess.CalledProcessError) else ''}"
                 )
                 raise FlashError(error_message) from e
             else:
                 ui.print_warning(f"La commande `{' '.join(command)}` a échoué, mais l'erreur est ignorée.")
 
-    def _manage_klipper_service(self, action: str):
+    async def _manage_klipper_service(self, action: str):
         """Démarre ou arrête le service Klipper."""
-        if not shutil.which("sudo"):
+        if not self._has_klipper_service:
+            ui.print_info(f"Le service Klipper n'est pas installé ({action} ignoré).")
+            return
+
+        if not self._sudo:
             ui.print_warning("'sudo' n'est pas installé. Impossible de gérer le service Klipper.")
             return
 
         ui.print_info(f"{action.capitalize()} du service Klipper...")
-        self._run_command(["sudo", "systemctl", action, "klipper.service"], ignore_errors=True)
+        await self._run_command([self._sudo, "systemctl", action, KLIPPER_SERVICE], ignore_errors=True)
 
     def detect_serial_devices(self) -> list[str]:
-        """Détecte les périphériques série potentiels."""
-        patterns = ["/dev/serial/by-id/*", "/dev/ttyUSB*", "/dev/ttyACM*"]
+        """
+        Détecte les périphériques série potentiels : liens de
+        `/dev/serial/by-id`, puis `/dev/ttyUSB*`, `/dev/ttyACM*` et `/dev/ttyCH*`.
+
+        La liste tenue à jour par udev est utilisée si pyudev est disponible.
+        Sinon, chaque répertoire n'est lu qu'une fois ; un répertoire absent
+        ou un lien orphelin est simplement ignoré.
+        """
+        watcher = utils.serial_watcher()
+        if watcher is not None:
+            return watcher.snapshot()
+
         devices = []
-        for pattern in patterns:
-            devices.extend(glob.glob(pattern))
+        try:
+            with os.scandir(SERIAL_BY_ID_DIR) as entries:
+                devices.extend(sorted(
+                    entry.path for entry in entries
+                    if entry.is_symlink() and _is_char_device(entry, follow_symlinks=True)
+                ))
+        except OSError:
+            pass
+        try:
+            with os.scandir(DEV_DIR) as entries:
+                devices.extend(sorted(
+                    entry.path for entry in entries
+                    if entry.name.startswith(SERIAL_DEVICE_PREFIXES) and _is_char_device(entry, follow_symlinks=False)
+                ))
+        except OSError:
+            pass
         return devices
 
-    def run(self, serial_device: str | None):
-        """Exécute toutes les étapes du flashage."""
+    @staticmethod
+    def _enable_choice_completion(choices: list[str]):
+        """Active l'édition de ligne et la complétion des numéros proposés (si readline existe)."""
+        try:
+            import readline
+        except ImportError:
+            return
+        readline.set_completer(lambda text, state: ([c for c in choices if c.startswith(text)] + [None])[state])
+        readline.parse_and_bind("tab: complete")
+
+    def _choose_serial_device(self) -> str:
+        """
+        Détecte les ports série et demande à l'utilisateur d'en choisir un s'il
+        y en a plusieurs, sauf si le dernier port flashé fait partie des ports détectés.
+        """
+        available_devices = self.detect_serial_devices()
+        if not available_devices:
+            raise FlashError("Aucun port série détecté. Veuillez en spécifier un avec l'argument --device.")
+        cached_device = utils.cached_device_among(available_devices)
+        if cached_device:
+            ui.print_info(f"Port série de la dernière utilisation : {cached_device}")
+            return cached_device
+        if len(available_devices) == 1:
+            ui.print_info(f"Un seul port série détecté : {available_devices[0]}")
+            return available_devices[0]
+
+        ui.print_info("Plusieurs ports série détectés. Veuillez choisir lequel utiliser :")
+        table_data = [[str(i + 1), device] for i, device in enumerate(available_devices)]
+        ui.print_table(["#", "Périphérique"], table_data)
+
+        choices = {str(i + 1): device for i, device in enumerate(available_devices)}
+        self._enable_choice_completion(list(choices))
+        while True:
+            choice = input(f"Entrez le numéro du port (1-{len(available_devices)}) : ").strip()
+            if choice in choices:
+                ui.print_info(f"Port série sélectionné : {choices[choice]}")
+                return choices[choice]
+            ui.print_error("Choix invalide. Veuillez entrer un numéro de la liste.")
+
+    async def _flash_device(self, serial_device: str):
+        """Flashe le firmware sur une carte avec wchisp."""
+        ui.print_info(f"Flashage de '{self.firmware_path.name}' sur '{serial_device}' avec wchisp...")
+        # Chemin résolu à l'initialisation : l'outil vérifié est celui qui est lancé.
+        command = [self._wchisp, "--serial", "--port", serial_device, "flash", str(self.firmware_path)]
+        await self._run_command(command, label=serial_device)
+        ui.print_success(f"Flashage réussi sur '{serial_device}' !")
+
+    async def _flash_all(self, serial_devices: list[str]):
+        """
+        Flashe toutes les cartes simultanément, entre un arrêt et un
+        redémarrage uniques du service Klipper.
+        """
+        import asyncio
+        await self._manage_klipper_service("stop")
+        try:
+            results = await asyncio.gather(
+                *(self._flash_device(device) for device in serial_devices),
+                return_exceptions=True,
+            )
+            errors = []
+            for device, result in zip(serial_devices, results):
+                if isinstance(result, FlashError):
+                    errors.append(f"--- {device} ---\n{result}")
+                elif isinstance(result, BaseException):
+                    raise result
+            if errors:
+                raise FlashError(f"Le flashage a échoué sur {len(errors)} carte(s) sur {len(serial_devices)} :\n" + "\n".join(errors))
+            if len(serial_devices) > 1:
+                ui.print_success(f"{len(serial_devices)} cartes flashées avec succès !")
+            else:
+                utils.save_cached_device(serial_devices[0])
+        finally:
+            await self._manage_klipper_service("start")
+
+    def run(self, serial_devices: list[str] | None):
+        """
+        Exécute toutes les étapes du flashage. Plusieurs cartes peuvent être
+        flashées en parallèle ; le service Klipper n'est arrêté qu'une fois
+        pour l'ensemble du lot.
+
+        `asyncio`, dont l'import est le plus coûteux du module, n'est importé
+        qu'au moment de flasher (comme `argparse` dans `main()`).
+        """
         if not self.firmware_path.is_file():
             raise FlashError(f"Le firmware '{self.firmware_path}' est introuvable. Avez-vous exécuté l'étape 2 ?")
 
-        bin_dir = self.base_dir / "bin"
-        env_path = f"{str(bin_dir.resolve())}{os.pathsep}{os.environ['PATH']}"
-        if not shutil.which("wchisp", path=env_path):
+        if not self._wchisp:
             raise FlashError("L'outil 'wchisp' est introuvable. Assurez-vous qu'il est installé et dans le PATH.")
 
-        if not serial_device:
+        if not serial_devices:
             ui.print_info("Aucun port série spécifié. Tentative de détection automatique...")
-            available_devices = self.detect_serial_devices()
-            if not available_devices:
-                raise FlashError("Aucun port série détecté. Veuillez en spécifier un avec l'argument --device.")
-            elif len(available_devices) == 1:
-                serial_device = available_devices[0]
-                ui.print_info(f"Un seul port série détecté : {serial_device}")
-            else:
-                ui.print_info("Plusieurs ports série détectés. Veuillez choisir lequel utiliser :")
-                table_data = [[str(i + 1), device] for i, device in enumerate(available_devices)]
-                ui.print_table(["#", "Périphérique"], table_data)
-
-                while True:
-                    try:
-                        choice = input(f"Entrez le numéro du port (1-{len(available_devices)}) : ")
-                        choice_index = int(choice) - 1
-                        if 0 <= choice_index < len(available_devices):
-                            serial_device = available_devices[choice_index]
-                            ui.print_info(f"Port série sélectionné : {serial_device}")
-                            break
-                        else:
-                            ui.print_error("Choix invalide. Veuillez réessayer.")
-                    except (ValueError, IndexError):
-                        ui.print_error("Entrée invalide. Veuillez entrer un numéro de la liste.")
-
-        if not ui.ask_confirmation(f"Prêt à flasher '{self.firmware_path.name}' sur '{serial_device}' ?"):
+            serial_devices = [self._choose_serial_device()]
+        else:
+            # Un port cité deux fois (--device X --devices X,Y) ne doit pas
+            # ouvrir deux sessions wchisp concurrentes : dédoublonnage ordonné.
+            serial_devices = list(dict.fromkeys(serial_devices))
+
+        targets = ", ".join(f"'{device}'" for device in serial_devices)
+        if not ui.ask_confirmation(f"Prêt à flasher '{self.firmware_path.name}' sur {targets} ?"):
             ui.print_warning("Flashage annulé par l'utilisateur.")
             return
 
-        self._manage_klipper_service("stop")
-        try:
-            ui.print_info(f"Flashage de '{self.firmware_path.name}' sur '{serial_device}' avec wchisp...")
-            command = ["wchisp", "--serial", "--port", serial_device, "flash", str(self.firmware_path)]
-            self._run_command(command)
-            ui.print_success("Flashage réussi !")
-        finally:
-            self._manage_klipper_service("start")
+        import asyncio
+        asyncio.run(self._flash_all(serial_devices))
 
 def main():
     """Point d'entrée du script."""
     import argparse
     parser = argparse.ArgumentParser(description="Flashe le firmware Klipper sur la BMCU-C.")
     parser.add_argument("-d", "--device", help="Chemin vers le port série (ex: /dev/ttyUSB0).")
+    parser.add_argument("--devices", help="Liste de ports séries séparés par des virgules, flashés en parallèle (ex: /dev/ttyUSB0,/dev/ttyUSB1).")
     args = parser.parse_args()
 
+    serial_devices = [device for device in (args.devices or "").split(",") if device]
+    if args.device:
+        serial_devices.insert(0, args.device)
+
     base_dir = Path(__file__).parent.resolve()
     try:
         manager = FlashManager(base_dir)
-        manager.run(args.device)
+        manager.run(serial_devices)
     except FlashError as e:
         ui.print_error(str(e))
         exit(1)
@@ -8,10 +8,33 @@ Ce script aide l'utilisateur à configurer Klipper après le flashage
 en générant le bloc de configuration `[bmcu]` nécessaire.
 """
 
-import glob
+import os
+import re
 import sys
-from pathlib import Path
 import ui
+import utils
+
+SERIAL_BY_ID_DIR = "/dev/serial/by-id"
+DEV_DIR = "/dev"
+# Préfixes des ports par ordre de priorité. Les chemins `/dev/serial/by-id/...`
+# sont stables et donc privilégiés ; ttyCH est caractéristique des puces WCH.
+DEVICE_PRIORITY = (
+    "/dev/serial/by-id/usb-Klipper_",
+    "/dev/serial/by-id/usb-1a86_USB_Serial",
+    "/dev/ttyCH",
+    "/dev/ttyACM",
+    "/dev/ttyUSB",
+)
+# Une seule expression : le numéro du groupe qui correspond donne la priorité.
+_DEVICE_PRIORITY_RE = re.compile("|".join(f"({re.escape(prefix)})" for prefix in DEVICE_PRIORITY))
+
+def _list_dir(path: str) -> list[str]:
+    """Liste les noms d'un répertoire en un seul parcours (vide s'il est absent)."""
+    try:
+        with os.scandir(path) as entries:
+            return sorted(entry.name for entry in entries)
+    except OSError:
+        return []
 
 class ConfigHelper:
     """Génère la configuration Klipper pour le BMCU."""
@@ -19,18 +42,32 @@ class ConfigHelper:
     def detect_serial_device(self) -> str | None:
         """Détecte le port série le plus probable pour la carte."""
         ui.print_info("Détection du port série de la carte BMCU-C...")
-        patterns = [
-            "/dev/serial/by-id/usb-Klipper_*",
-            "/dev/serial/by-id/usb-1a86_USB_Serial*",
-            "/dev/ttyCH*", # Caractéristique des puces WCH
-            "/dev/ttyACM*",
-            "/dev/ttyUSB*",
-        ]
-        for pattern in patterns:
-            devices = glob.glob(pattern)
-            if devices:
-                ui.print_success(f"Port série détecté : {devices[0]}")
-                return devices[0]
+        watcher = utils.serial_watcher()
+        snapshot = watcher.snapshot() if watcher is not None else None
+        # Les préfixes de `by-id` passant avant ceux de `/dev`, ce dernier
+        # n'est parcouru que si `by-id` ne contient aucun candidat.
+        for directory in (SERIAL_BY_ID_DIR, DEV_DIR):
+            if snapshot is None:
+                devices = [os.path.join(directory, name) for name in _list_dir(directory)]
+            else:
+                devices = [device for device in snapshot if os.path.dirname(device) == directory]
+            candidates = [
+                (match.lastindex, device)
+                for device in devices
+                if (match := _DEVICE_PRIORITY_RE.match(device))
+            ]
+            if candidates:
+                # Le dernier port flashé ne départage que les ports du meilleur
+                # groupe de priorité : il ne passe jamais devant un lien by-id.
+                best_priority = min(candidates)[0]
+                best_group = [device for priority, device in candidates if priority == best_priority]
+                cached_device = utils.cached_device_among(best_group)
+                if cached_device:
+                    ui.print_success(f"Port série détecté (dernière utilisation) : {cached_device}")
+                    return cached_device
+                device = min(best_group)
+                ui.print_success(f"Port série détecté : {device}")
+                return device
         return None
 
     def run(self):
@@ -62,9 +99,10 @@ serial: {ui.AnsiColors.YELLOW}{serial_device}{ui.AnsiColors.RESET}
 # {ui.AnsiColors.GREY}heater_bed_temp_pin: bmcu:PA2{ui.AnsiColors.RESET}
 #--------------------------------------------------------------------
 """
-        print("\n")
-        ui.print_header("CONFIGURATION KLIPPER POUR LA BMCU-C")
-        print(config_block)
+        # En-tête et bloc de configuration émis en une seule écriture
+        header = ui.format_header("CONFIGURATION KLIPPER POUR LA BMCU-C")
+        sys.stdout.write(f"\n\n\n{header}\n{config_block}\n")
+        sys.stdout.flush()
 
 def main():
     """Point d'entrée du script."""
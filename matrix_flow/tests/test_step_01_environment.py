@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+"""Tests pour l'étape 1 : Préparation de l'environnement."""
+
+import gzip
+import http.server
+import io
+import json
+import os
+import re
+import shutil
+import tarfile
+import threading
+import time
+import pytest
+
+from matrix_flow import step_01_environment
+from matrix_flow.step_01_environment import EnvironmentManager, _extract_members, _sha256_file
+
+def make_toolchain_archive(tmp_path):
+    """Crée une archive de toolchain minimale et retourne (chemin, sha256)."""
+    source_dir = tmp_path / "src" / "xpack-riscv" / "bin"
+    source_dir.mkdir(parents=True)
+    (source_dir / "riscv-none-elf-gcc").write_text("#!/bin/sh\n")
+    archive_path = tmp_path / "toolchain.tar.gz"
+    with archive_path.open("wb") as fileobj, tarfile.open(fileobj=fileobj, mode="w|gz") as tar:
+        tar.add(tmp_path / "src" / "xpack-riscv", arcname="xpack-riscv")
+    return archive_path, _sha256_file(archive_path)
+
+def make_manager(mocker, tmp_path, archive_path, url=None):
+    """Prépare un EnvironmentManager pointant vers une archive locale (file:// par défaut)."""
+    base_dir = tmp_path / "base"
+    base_dir.mkdir()
+    toolchain = {"urls": {"x86_64": url or archive_path.as_uri()}, "subdirectory": "riscv-toolchain"}
+    config = {"klipper": {"repository_url": "unused", "git_ref": "v0.13.0"}, "toolchain": toolchain}
+    (base_dir / "config.json").write_text(json.dumps(config), encoding="utf-8")
+    mocker.patch("matrix_flow.step_01_environment.platform.machine", return_value="x86_64")
+    return EnvironmentManager(base_dir)
+
+def test_toolchain_is_cached_by_sha256(mocker, tmp_path):
+    """Vérifie que la toolchain est extraite dans un cache adressé par son SHA256."""
+    archive_path, sha256 = make_toolchain_archive(tmp_path)
+    manager = make_manager(mocker, tmp_path, archive_path)
+
+    manager.ensure_toolchain()
+
+    assert (manager.toolchain_dir / "bin" / "riscv-none-elf-gcc").is_file()
+    assert manager.toolchain_dir.resolve().name == f"toolchain-{sha256[:8]}"
+    assert (manager.archives_dir / f"{sha256}.tar.gz").read_bytes() == archive_path.read_bytes()
+
+    # Une fois le lien supprimé, le cache est réutilisé sans téléchargement.
+    manager.toolchain_dir.unlink()
+    urlopen = mocker.patch("matrix_flow.step_01_environment.urllib.request.urlopen")
+    manager.ensure_toolchain()
+    urlopen.assert_not_called()
+    assert (manager.toolchain_dir / "bin" / "riscv-none-elf-gcc").is_file()
+
+def test_toolchain_follows_url_change_in_config(mocker, tmp_path):
+    """Vérifie qu'un changement d'URL dans config.json déplace le lien, sans retéléchargement pour une version connue."""
+    archive_a, sha256_a = make_toolchain_archive(tmp_path)
+    source_b = tmp_path / "src_b" / "xpack-riscv" / "bin"
+    source_b.mkdir(parents=True)
+    (source_b / "riscv-none-elf-gcc").write_text("#!/bin/sh\n# version B\n")
+    archive_b = tmp_path / "toolchain_b.tar.gz"
+    with archive_b.open("wb") as fileobj, tarfile.open(fileobj=fileobj, mode="w|gz") as tar:
+        tar.add(tmp_path / "src_b" / "xpack-riscv", arcname="xpack-riscv")
+    sha256_b = _sha256_file(archive_b)
+
+    manager = make_manager(mocker, tmp_path, archive_a)
+    manager.ensure_toolchain()
+    config_path = manager.config_path
+
+    def switch_to(archive_path, mtime_ns):
+        config = json.loads(config_path.read_text(encoding="utf-8"))
+        config["toolchain"]["urls"]["x86_64"] = archive_path.as_uri()
+        config_path.write_text(json.dumps(config), encoding="utf-8")
+        os.utime(config_path, ns=(mtime_ns, mtime_ns))
+        return EnvironmentManager(manager.base_dir)
+
+    manager = switch_to(archive_b, 1_000_000_000)
+    manager.ensure_toolchain()
+    assert os.readlink(manager.toolchain_dir) == f"toolchain-{sha256_b[:8]}"
+
+    urlopen = mocker.patch("matrix_flow.step_01_environment.urllib.request.urlopen")
+    manager = switch_to(archive_a, 2_000_000_000)
+    manager.ensure_toolchain()
+    urlopen.assert_not_called()
+    assert os.readlink(manager.toolchain_dir) == f"toolchain-{sha256_a[:8]}"
+
+def test_extract_members_preserves_modes_and_links(tmp_path):
+    """Vérifie l'extraction parallèle : permissions, liens symboliques et physiques."""
+    source = tmp_path / "src" / "xpack" / "bin"
+    source.mkdir(parents=True)
+    gcc = source / "riscv-none-elf-gcc"
+    gcc.write_bytes(b"\x7fELF" * 1000)
+    gcc.chmod(0o755)
+    (source / "cc").symlink_to("riscv-none-elf-gcc")
+    os.link(gcc, source / "gcc-hardlink")
+    archive_path = tmp_path / "archive.tar.gz"
+    with archive_path.open("wb") as fileobj, tarfile.open(fileobj=fileobj, mode="w|gz") as tar:
+        tar.add(tmp_path / "src" / "xpack", arcname="xpack")
+
+    dest = tmp_path / "dest"
+    with tarfile.open(archive_path, mode="r|gz") as tar:
+        _extract_members(tar, dest)
+
+    bin_dir = dest / "xpack" / "bin"
+    assert (bin_dir / "riscv-none-elf-gcc").read_bytes() == gcc.read_bytes()
+    assert (bin_dir / "riscv-none-elf-gcc").stat().st_mode & 0o777 == 0o755
+    assert os.readlink(bin_dir / "cc") == "riscv-none-elf-gcc"
+    assert (bin_dir / "gcc-hardlink").read_bytes() == gcc.read_bytes()
+
+
+@pytest.mark.parametrize("data_filter", [step_01_environment._DATA_FILTER, None], ids=["filtre-data", "sans-filtre"])
+@pytest.mark.parametrize(
+    "link_name, link_target, member_name",
+    [("tc/lib", "", "tc/lib/evil"), ("tc/x", "target", "tc/x")],
+    ids=["fichier-sous-le-lien", "fichier-a-la-place-du-lien"],
+)
+def test_extract_members_rejects_writes_through_symlinks(mocker, tmp_path, data_filter, link_name, link_target, member_name):
+    """Vérifie qu'un fichier écrit sous ou à la place d'un lien symbolique sortant de la destination est refusé."""
+    mocker.patch("matrix_flow.step_01_environment._DATA_FILTER", data_filter)
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "target").write_text("original")
+    archive_path = tmp_path / "evil.tar"
+    with tarfile.open(archive_path, mode="w") as tar:
+        link = tarfile.TarInfo(link_name)
+        link.type = tarfile.SYMTYPE
+        link.linkname = str(outside / link_target)
+        tar.addfile(link)
+        payload = b"pwned"
+        evil = tarfile.TarInfo(member_name)
+        evil.size = len(payload)
+        tar.addfile(evil, io.BytesIO(payload))
+
+    with tarfile.open(archive_path, mode="r|") as tar, pytest.raises(tarfile.TarError):
+        _extract_members(tar, tmp_path / "dest")
+
+    assert [path.name for path in outside.iterdir()] == ["target"]
+    assert (outside / "target").read_text() == "original"
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """Serveur HTTP minimal qui sert `payload` et accepte les requêtes de plage."""
+
+    payload = b""
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.payload)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        start, end = map(int, re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers["Range"]).groups())
+        body = self.payload[start:end + 1]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def test_toolchain_is_downloaded_by_ranges(mocker, tmp_path):
+    """Vérifie le téléchargement en plages parallèles quand le serveur les accepte."""
+    archive_path, sha256 = make_toolchain_archive(tmp_path)
+    RangeHandler.payload = archive_path.read_bytes()
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    mocker.patch("matrix_flow.step_01_environment.RANGE_MIN_SIZE", 1)
+    download_ranges = mocker.spy(EnvironmentManager, "_download_ranges")
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/toolchain.tar.gz"
+        manager = make_manager(mocker, tmp_path, archive_path, url=url)
+        manager.ensure_toolchain()
+    finally:
+        server.shutdown()
+
+    download_ranges.assert_called_once()
+    assert (manager.toolchain_dir / "bin" / "riscv-none-elf-gcc").is_file()
+    assert (manager.archives_dir / f"{sha256}.tar.gz").read_bytes() == archive_path.read_bytes()
+
+def test_cached_archive_uses_rapidgzip_when_available(mocker, tmp_path):
+    """Vérifie que l'archive en cache passe par rapidgzip quand le module est installé."""
+    archive_path, sha256 = make_toolchain_archive(tmp_path)
+    manager = make_manager(mocker, tmp_path, archive_path)
+    manager.ensure_toolchain()
+    manager.toolchain_dir.unlink()
+    shutil.rmtree(manager.toolchain_dir.parent / f"toolchain-{sha256[:8]}")
+
+    fake_rapidgzip = mocker.Mock()
+    fake_rapidgzip.open.side_effect = lambda path, parallelization: gzip.open(path)
+    mocker.patch("matrix_flow.step_01_environment.rapidgzip", fake_rapidgzip)
+    manager.ensure_toolchain()
+
+    fake_rapidgzip.open.assert_called_once()
+    assert (manager.toolchain_dir / "bin" / "riscv-none-elf-gcc").is_file()
+
+def test_run_downloads_in_main_thread_and_buffers_git_output(mocker, tmp_path):
+    """Vérifie que la toolchain est préparée dans le thread principal et que les messages de git sont affichés après."""
+    archive_path, _ = make_toolchain_archive(tmp_path)
+    manager = make_manager(mocker, tmp_path, archive_path)
+    mocker.patch.object(manager, "check_system_dependencies")
+    mocker.patch.object(manager, "_run_command")
+    repo_started = threading.Event()
+    printed = []
+    mocker.patch("matrix_flow.step_01_environment.ui.print_info", side_effect=lambda text: printed.append(text))
+    mocker.patch("matrix_flow.step_01_environment.ui.print_success", side_effect=lambda text: printed.append(text))
+    real_ensure_klipper_repo = manager.ensure_klipper_repo
+
+    def ensure_klipper_repo(output):
+        repo_started.set()
+        real_ensure_klipper_repo(output)
+
+    def ensure_toolchain():
+        assert threading.current_thread() is threading.main_thread()
+        repo_started.wait(5)
+        time.sleep(0.05)
+        step_01_environment.ui.print_info("toolchain prête")
+
+    mocker.patch.object(manager, "ensure_klipper_repo", side_effect=ensure_klipper_repo)
+    mocker.patch.object(manager, "ensure_toolchain", side_effect=ensure_toolchain)
+    manager.run()
+
+    assert printed[0] == "toolchain prête"
+    assert printed[-1] == "Dépôt Klipper OK."
+
+def test_run_interrupt_does_not_wait_for_background_clone(mocker, tmp_path):
+    """Vérifie qu'un Ctrl-C pendant le téléchargement n'attend pas la fin du clonage."""
+    archive_path, _ = make_toolchain_archive(tmp_path)
+    manager = make_manager(mocker, tmp_path, archive_path)
+    mocker.patch.object(manager, "check_system_dependencies")
+    release = threading.Event()
+    mocker.patch.object(manager, "ensure_klipper_repo", side_effect=lambda output: release.wait(5))
+    mocker.patch.object(manager, "ensure_toolchain", side_effect=KeyboardInterrupt)
+
+    started = time.monotonic()
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            manager.run()
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+
+@pytest.mark.parametrize("exit_code", [0, 3])
+def test_extract_archive_through_pigz(mocker, monkeypatch, tmp_path, exit_code):
+    """Vérifie l'extraction via un pigz du PATH, et l'erreur si pigz se termine en échec."""
+    archive_path, _ = make_toolchain_archive(tmp_path)
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    pigz = bin_dir / "pigz"
+    pigz.write_text(f"#!/bin/sh\ngzip -dc\nexit {exit_code}\n", encoding="utf-8")
+    pigz.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    step_01_environment.utils.which.cache_clear()
+    mocker.patch("matrix_flow.step_01_environment.rapidgzip", None)
+    try:
+        manager = make_manager(mocker, tmp_path, archive_path)
+    finally:
+        step_01_environment.utils.which.cache_clear()
+    assert manager._pigz_path == str(pigz)
+
+    dest = tmp_path / "dest"
+    with archive_path.open("rb") as stream:
+        if exit_code:
+            with pytest.raises(tarfile.TarError, match=f"code {exit_code}"):
+                manager._extract_archive(stream, dest)
+        else:
+            manager._extract_archive(stream, dest)
+            assert (dest / "xpack-riscv" / "bin" / "riscv-none-elf-gcc").read_text() == "#!/bin/sh\n"
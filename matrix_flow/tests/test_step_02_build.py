@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""Tests pour l'étape 2 : Compilation du firmware."""
+
+import json
+import os
+import sys
+import pytest
+
+from matrix_flow.step_02_build import BuildManager, BuildError, _clone_file
+
+def make_manager(tmp_path):
+    """Prépare un BuildManager avec des sources Klipper et une toolchain factices."""
+    (tmp_path / "config.json").write_text(
+        json.dumps({"toolchain": {"subdirectory": "riscv-toolchain"}}), encoding="utf-8"
+    )
+    (tmp_path / "klipper.config").write_text("CONFIG_MACH_CH32V20X=y\n", encoding="utf-8")
+    (tmp_path / "klipper_overrides").mkdir()
+    (tmp_path / "klipper_overrides" / "Kconfig").write_text("# surcharge\n", encoding="utf-8")
+    (tmp_path / ".cache" / "riscv-toolchain" / "bin").mkdir(parents=True)
+    (tmp_path / ".cache" / "klipper" / "out").mkdir(parents=True)
+    return BuildManager(tmp_path)
+
+def test_unchanged_sources_skip_the_build(mocker, tmp_path):
+    """Vérifie que la compilation est sautée quand aucune entrée n'a changé."""
+    manager = make_manager(tmp_path)
+    run_command = mocker.patch.object(
+        manager, "_run_command_with_spinner",
+        side_effect=lambda *a, **k: manager.firmware_path.write_bytes(b"fw"),
+    )
+
+    manager.run()
+    commands = [call.args[0] for call in run_command.call_args_list]
+    assert ["make", "clean"] in commands
+
+    run_command.reset_mock()
+    assert manager.run() == manager.firmware_path
+    run_command.assert_not_called()
+
+    # Une surcharge modifiée relance une compilation incrémentale, sans `make clean`.
+    (tmp_path / "klipper_overrides" / "Kconfig").write_text("# surcharge modifiée\n", encoding="utf-8")
+    manager.run()
+    commands = [call.args[0] for call in run_command.call_args_list]
+    assert ["make", "olddefconfig"] in commands
+    assert ["make", "clean"] not in commands
+
+def test_toolchain_change_forces_clean(mocker, tmp_path):
+    """Vérifie qu'un changement de toolchain, à configuration identique, relance `make clean`."""
+    manager = make_manager(tmp_path)
+    run_command = mocker.patch.object(
+        manager, "_run_command_with_spinner",
+        side_effect=lambda *a, **k: manager.firmware_path.write_bytes(b"fw"),
+    )
+    toolchain_v1 = tmp_path / ".cache" / "riscv-toolchain"
+    toolchain_v1.rename(tmp_path / ".cache" / "toolchain-aaaaaaaa")
+    toolchain_v1.symlink_to("toolchain-aaaaaaaa")
+    manager.run()
+
+    (tmp_path / ".cache" / "toolchain-bbbbbbbb" / "bin").mkdir(parents=True)
+    toolchain_v1.unlink()
+    toolchain_v1.symlink_to("toolchain-bbbbbbbb")
+    run_command.reset_mock()
+    manager.run()
+    commands = [call.args[0] for call in run_command.call_args_list]
+    assert ["make", "clean"] in commands
+
+def test_ccache_is_injected_through_path(mocker, tmp_path):
+    """Vérifie que ccache masque le compilateur de la toolchain quand il est disponible."""
+    manager = make_manager(tmp_path)
+    gcc = manager.toolchain_dir / "bin" / "riscv-none-elf-gcc"
+    gcc.touch()
+    mocker.patch.object(manager, "_ccache_path", "/usr/bin/ccache")
+    script = "import os; print(os.environ['PATH']); print(os.environ['CCACHE_DIR'])"
+
+    result = manager._run_command_with_spinner([sys.executable, "-c", script], cwd=tmp_path, title="Compilation")
+
+    path, ccache_dir = result.stdout.splitlines()
+    assert path.split(os.pathsep)[0] == str(manager.ccache_bin_dir)
+    assert ccache_dir == str(manager.ccache_dir)
+    assert (manager.ccache_bin_dir / "riscv-none-elf-gcc").readlink().as_posix() == "/usr/bin/ccache"
+
+def test_failed_command_reports_output_tail(tmp_path):
+    """Vérifie qu'un échec rapporte uniquement la fin des sorties de la commande."""
+    manager = make_manager(tmp_path)
+    script = "import sys; [print(i) for i in range(2000)]; sys.stderr.write('erreur fatale'); sys.exit(2)"
+
+    with pytest.raises(BuildError) as excinfo:
+        manager._run_command_with_spinner([sys.executable, "-c", script], cwd=tmp_path, title="Compilation")
+
+    message = str(excinfo.value)
+    assert "code 2" in message and "erreur fatale" in message
+    assert "1999" in message and "\n1499\n" not in message
+
+def test_overrides_are_linked_and_stale_ones_removed(tmp_path):
+    """Vérifie que les surcharges sont liées sans copie et que les anciennes sont retirées."""
+    manager = make_manager(tmp_path)
+    extra = tmp_path / "klipper_overrides" / "src" / "extra.c"
+    extra.parent.mkdir()
+    extra.write_text("int x;\n", encoding="utf-8")
+
+    manager._apply_overrides()
+    assert (manager.klipper_dir / "src" / "extra.c").samefile(extra)
+    assert (manager.klipper_dir / "Kconfig").read_text(encoding="utf-8") == "# surcharge\n"
+
+    extra.unlink()
+    manager._apply_overrides()
+    assert not (manager.klipper_dir / "src" / "extra.c").exists()
+    assert (manager.klipper_dir / "Kconfig").exists()
+
+def test_clone_file_falls_back_to_copy_on_any_error(mocker, tmp_path):
+    """Vérifie qu'une erreur quelconque des voies rapides mène à la copie, et l'échec de celle-ci à une BuildError."""
+    src = tmp_path / "src.c"
+    src.write_text("int y;\n", encoding="utf-8")
+    dst = tmp_path / "dst.c"
+    mocker.patch("matrix_flow.step_02_build.os.link", side_effect=PermissionError(13, "EACCES"))
+    mocker.patch("matrix_flow.step_02_build.fcntl.ioctl", side_effect=OSError(1, "EPERM"))
+
+    _clone_file(str(src), str(dst))
+    assert dst.read_text(encoding="utf-8") == "int y;\n"
+    assert not dst.samefile(src)
+
+    mocker.patch("matrix_flow.step_02_build.shutil.copy2", side_effect=PermissionError(13, "EACCES"))
+    with pytest.raises(BuildError, match="Impossible de copier"):
+        _clone_file(str(src), str(dst))
@@ -2,20 +2,50 @@
 
 """Tests pour l'étape 3 : Flashage du firmware."""
 
+import io
 import subprocess
 from unittest.mock import patch
 import pytest
 
 from matrix_flow.step_03_flash import FlashManager, FlashError
 
+class FakeStream:
+    """Flux de sortie asynchrone d'un processus simulé."""
+
+    def __init__(self, output: str):
+        self._data = io.BytesIO(output.encode("utf-8"))
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._data.read(size)
+
+class FakeProcess:
+    """Remplace le processus d'`asyncio.create_subprocess_exec` : sortie et code de retour prédéfinis."""
+
+    def __init__(self, *command, returncode=0, output=""):
+        self.args = list(command)
+        self.returncode = returncode
+        self.stdout = FakeStream(output)
+
+    async def wait(self) -> int:
+        return self.returncode
+
+# Outils résolus par `fake_which` : les commandes lancées doivent utiliser ces chemins.
+WCHISP = "/opt/fake/bin/wchisp"
+SUDO = "/opt/fake/bin/sudo"
+
+def fake_which(name, path=None):
+    """Remplace `utils.which` : chaque outil est « trouvé » dans /opt/fake/bin."""
+    return f"/opt/fake/bin/{name}"
+
+@pytest.fixture(autouse=True)
+def isolated_device_cache(mocker, tmp_path):
+    """Redirige le cache du dernier port série vers un répertoire temporaire."""
+    mocker.patch("matrix_flow.step_03_flash.utils.LAST_DEVICE_PATH", tmp_path / "last_device")
+
 def test_flash_manager_initialization(tmp_path):
     """Vérifie que le FlashManager s'initialise correctement."""
-    cache_dir = tmp_path / ".cache"
-    cache_dir.mkdir()
-    klipper_dir = cache_dir / "klipper"
-    klipper_dir.mkdir()
-    out_dir = klipper_dir / "out"
-    out_dir.mkdir()
+    out_dir = tmp_path / ".cache" / "klipper" / "out"
+    out_dir.mkdir(parents=True)
     firmware_path = out_dir / "klipper.bin"
     firmware_path.touch()
 
@@ -29,16 +59,16 @@ def test_flash_success(mocker, tmp_path):
     firmware_path.parent.mkdir(parents=True)
     firmware_path.touch()
 
-    mocker.patch("shutil.which", return_value=True)
+    mocker.patch("matrix_flow.step_03_flash.utils.which", side_effect=fake_which)
     mocker.patch("matrix_flow.step_03_flash.ui.ask_confirmation", return_value=True)
-    mock_subprocess_run = mocker.patch("subprocess.run", return_value=subprocess.CompletedProcess(args=[], returncode=0))
+    create_process = mocker.patch("asyncio.create_subprocess_exec", side_effect=lambda *command, **kwargs: FakeProcess(*command, output="Flash OK\n"))
 
     manager = FlashManager(base_dir=tmp_path)
-    manager.run(serial_device="/dev/fake_port")
+    manager.run(["/dev/fake_port"])
 
     # Vérifie que les commandes ont été appelées
-    expected_flash_cmd = ["wchisp", "--serial", "--port", "/dev/fake_port", "flash", str(firmware_path)]
-    mock_subprocess_run.assert_any_call(expected_flash_cmd, check=True, capture_output=True, text=True, encoding="utf-8", errors="replace", env=mocker.ANY)
+    expected_flash_cmd = [WCHISP, "--serial", "--port", "/dev/fake_port", "flash", str(firmware_path)]
+    create_process.assert_any_call(*expected_flash_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=mocker.ANY)
 
 
 def test_flash_failure(mocker, tmp_path):
@@ -47,16 +77,162 @@ def test_flash_failure(mocker, tmp_path):
     firmware_path.parent.mkdir(parents=True)
     firmware_path.touch()
 
-    mocker.patch("shutil.which", return_value=True)
+    mocker.patch("matrix_flow.step_03_flash.utils.which", side_effect=fake_which)
     mocker.patch("matrix_flow.step_03_flash.ui.ask_confirmation", return_value=True)
 
-    def mock_run(command, **kwargs):
-        if "wchisp" in command:
-            raise subprocess.CalledProcessError(1, command, stderr="Flash failed!")
-        return subprocess.CompletedProcess(command, 0)
+    def create_process(*command, **kwargs):
+        if WCHISP in command:
+            return FakeProcess(*command, returncode=1, output="Flash failed!\n")
+        return FakeProcess(*command)
 
-    mocker.patch("subprocess.run", side_effect=mock_run)
+    mocker.patch("asyncio.create_subprocess_exec", side_effect=create_process)
 
     manager = FlashManager(base_dir=tmp_path)
     with pytest.raises(FlashError, match="Flash failed!"):
-        manager.run(serial_device="/dev/fake_port")
+        manager.run(["/dev/fake_port"])
+
+
+def test_detect_serial_devices(mocker, tmp_path):
+    """Vérifie la détection des ports série et le rejet des entrées invalides."""
+    by_id = tmp_path / "by-id"
+    by_id.mkdir()
+    (by_id / "usb-wch_ch340").symlink_to("/dev/null")
+    (by_id / "usb-stale").symlink_to(tmp_path / "missing")
+    dev = tmp_path / "dev"
+    dev.mkdir()
+    (dev / "ttyUSB0").touch()  # fichier ordinaire : ignoré
+    mocker.patch("matrix_flow.step_03_flash.SERIAL_BY_ID_DIR", str(by_id))
+    mocker.patch("matrix_flow.step_03_flash.DEV_DIR", str(dev))
+    mocker.patch("matrix_flow.step_03_flash.utils.serial_watcher", return_value=None)
+
+    manager = FlashManager(base_dir=tmp_path)
+    assert manager.detect_serial_devices() == [str(by_id / "usb-wch_ch340")]
+
+    mocker.patch("matrix_flow.step_03_flash.SERIAL_BY_ID_DIR", str(tmp_path / "absent"))
+    assert manager.detect_serial_devices() == []
+
+
+def test_detect_serial_devices_uses_udev_snapshot(mocker, tmp_path):
+    """Vérifie que la liste tenue par udev remplace le parcours de /dev."""
+    watcher = mocker.Mock()
+    watcher.snapshot.return_value = ["/dev/serial/by-id/usb-1a86_USB_Serial-if00", "/dev/ttyUSB0"]
+    mocker.patch("matrix_flow.step_03_flash.utils.serial_watcher", return_value=watcher)
+    scandir = mocker.patch("matrix_flow.step_03_flash.os.scandir")
+
+    manager = FlashManager(base_dir=tmp_path)
+    assert manager.detect_serial_devices() == ["/dev/serial/by-id/usb-1a86_USB_Serial-if00", "/dev/ttyUSB0"]
+    scandir.assert_not_called()
+
+
+def test_flash_multiple_devices_in_parallel(mocker, tmp_path):
+    """Vérifie le flashage d'un lot de cartes et l'agrégation des échecs."""
+    firmware_path = tmp_path / ".cache/klipper/out/klipper.bin"
+    firmware_path.parent.mkdir(parents=True)
+    firmware_path.touch()
+
+    mocker.patch("matrix_flow.step_03_flash.utils.which", side_effect=fake_which)
+    mocker.patch("matrix_flow.step_03_flash.ui.ask_confirmation", return_value=True)
+
+    def create_process(*command, **kwargs):
+        if "/dev/bad_port" in command:
+            return FakeProcess(*command, returncode=1, output="Flash failed!\n")
+        return FakeProcess(*command)
+
+    create_process_calls = mocker.patch("asyncio.create_subprocess_exec", side_effect=create_process)
+    (tmp_path / "klipper.service").touch()
+    mocker.patch("matrix_flow.step_03_flash.SYSTEMD_UNIT_DIRS", (str(tmp_path),))
+
+    manager = FlashManager(base_dir=tmp_path)
+    with pytest.raises(FlashError, match="1 carte\\(s\\) sur 3") as excinfo:
+        manager.run(["/dev/port_a", "/dev/bad_port", "/dev/port_b"])
+
+    assert "/dev/bad_port" in str(excinfo.value)
+    flashed = [call.args[3] for call in create_process_calls.call_args_list if call.args[0] == WCHISP]
+    assert sorted(flashed) == ["/dev/bad_port", "/dev/port_a", "/dev/port_b"]
+    systemctl = [call.args[2] for call in create_process_calls.call_args_list if call.args[0] == SUDO]
+    assert systemctl == ["stop", "start"]
+
+
+def test_klipper_service_is_skipped_when_not_installed(mocker, tmp_path):
+    """Vérifie qu'aucun appel à sudo n'est fait sans unité klipper.service."""
+    firmware_path = tmp_path / ".cache/klipper/out/klipper.bin"
+    firmware_path.parent.mkdir(parents=True)
+    firmware_path.touch()
+
+    mocker.patch("matrix_flow.step_03_flash.utils.which", side_effect=fake_which)
+    mocker.patch("matrix_flow.step_03_flash.ui.ask_confirmation", return_value=True)
+    mocker.patch("matrix_flow.step_03_flash.SYSTEMD_UNIT_DIRS", (str(tmp_path / "systemd"),))
+    create_process = mocker.patch("asyncio.create_subprocess_exec", side_effect=lambda *command, **kwargs: FakeProcess(*command))
+
+    FlashManager(base_dir=tmp_path).run(["/dev/fake_port"])
+
+    assert [call.args[0] for call in create_process.call_args_list] == [WCHISP]
+
+
+def test_interactive_device_choice(mocker, tmp_path):
+    """Vérifie que le choix du port est redemandé tant qu'il n'est pas dans la liste."""
+    firmware_path = tmp_path / ".cache/klipper/out/klipper.bin"
+    firmware_path.parent.mkdir(parents=True)
+    firmware_path.touch()
+
+    mocker.patch("matrix_flow.step_03_flash.utils.which", side_effect=fake_which)
+    mocker.patch("matrix_flow.step_03_flash.ui.ask_confirmation", return_value=True)
+    mocker.patch("matrix_flow.step_03_flash.SYSTEMD_UNIT_DIRS", ())
+    mocker.patch.object(FlashManager, "detect_serial_devices", return_value=["/dev/ttyUSB0", "/dev/ttyUSB1"])
+    mocker.patch.object(FlashManager, "_enable_choice_completion")
+    prompt = mocker.patch("builtins.input", side_effect=["abc", "3", " 2 "])
+    create_process = mocker.patch("asyncio.create_subprocess_exec", side_effect=lambda *command, **kwargs: FakeProcess(*command))
+
+    FlashManager(base_dir=tmp_path).run(None)
+
+    assert prompt.call_count == 3
+    create_process.assert_called_once()
+    assert create_process.call_args.args[3] == "/dev/ttyUSB1"
+
+
+def test_last_device_is_reused(mocker, tmp_path):
+    """Vérifie que le port flashé avec succès est repris s'il fait partie des ports détectés."""
+    firmware_path = tmp_path / ".cache/klipper/out/klipper.bin"
+    firmware_path.parent.mkdir(parents=True)
+    firmware_path.touch()
+
+    mocker.patch("matrix_flow.step_03_flash.utils.which", side_effect=fake_which)
+    mocker.patch("matrix_flow.step_03_flash.ui.ask_confirmation", return_value=True)
+    mocker.patch("matrix_flow.step_03_flash.SYSTEMD_UNIT_DIRS", ())
+    create_process = mocker.patch("asyncio.create_subprocess_exec", side_effect=lambda *command, **kwargs: FakeProcess(*command))
+    manager = FlashManager(base_dir=tmp_path)
+    manager.run(["/dev/ttyUSB1"])
+
+    detect = mocker.patch.object(FlashManager, "detect_serial_devices", return_value=["/dev/ttyUSB0", "/dev/ttyUSB1"])
+    prompt = mocker.patch("builtins.input")
+    manager.run(None)
+    prompt.assert_not_called()
+    assert create_process.call_args.args[3] == "/dev/ttyUSB1"
+
+    # Un port absent de la détection n'est jamais repris à l'aveugle.
+    detect.return_value = ["/dev/ttyUSB0"]
+    manager.run(None)
+    assert create_process.call_args.args[3] == "/dev/ttyUSB0"
+
+    detect.return_value = []
+    with pytest.raises(FlashError, match="Aucun port série détecté"):
+        manager.run(None)
+
+
+def test_duplicate_devices_are_flashed_once_with_prefixed_output(mocker, tmp_path):
+    """Vérifie qu'un port cité deux fois n'est flashé qu'une fois et que sa sortie est préfixée."""
+    firmware_path = tmp_path / ".cache/klipper/out/klipper.bin"
+    firmware_path.parent.mkdir(parents=True)
+    firmware_path.touch()
+
+    mocker.patch("matrix_flow.step_03_flash.utils.which", side_effect=fake_which)
+    mocker.patch("matrix_flow.step_03_flash.ui.ask_confirmation", return_value=True)
+    mocker.patch("matrix_flow.step_03_flash.SYSTEMD_UNIT_DIRS", ())
+    print_info = mocker.patch("matrix_flow.step_03_flash.ui.print_info")
+    create_process = mocker.patch("asyncio.create_subprocess_exec", side_effect=lambda *command, **kwargs: FakeProcess(*command, output="Flash OK\n"))
+
+    FlashManager(base_dir=tmp_path).run(["/dev/port_a", "/dev/port_b", "/dev/port_a"])
+
+    assert [call.args[3] for call in create_process.call_args_list] == ["/dev/port_a", "/dev/port_b"]
+    print_info.assert_any_call("[/dev/port_a] Flash OK")
+    print_info.assert_any_call("[/dev/port_b] Flash OK")
@@ -8,15 +8,28 @@ import pytest
 
 from matrix_flow.step_04_configure import ConfigHelper
 
+# Séquences d'échappement ANSI (couleurs, déplacements du curseur)
+_ANSI_RE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
 def strip_ansi(text: str) -> str:
     """Supprime les codes d'échappement ANSI d'une chaîne."""
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    return ansi_escape.sub('', text)
+    return _ANSI_RE.sub('', text)
+
+@pytest.fixture(autouse=True)
+def isolated_device_cache(mocker, tmp_path):
+    """Redirige le cache du dernier port série vers un répertoire temporaire."""
+    mocker.patch("matrix_flow.step_04_configure.utils.LAST_DEVICE_PATH", tmp_path / "last_device")
+
+@pytest.fixture(autouse=True)
+def no_udev(mocker):
+    """Force la détection par le système de fichiers, même si pyudev est installé."""
+    mocker.patch("matrix_flow.step_04_configure.utils.serial_watcher", return_value=None)
 
 def test_configuration_generation_with_device_found(mocker, capsys):
     """Vérifie que le bloc de configuration est correct lorsqu'un port est trouvé."""
     # Simule la découverte d'un port série
-    mocker.patch("glob.glob", return_value=["/dev/serial/by-id/usb-Klipper_123"])
+    listings = {"/dev/serial/by-id": ["usb-1a86_USB_Serial-if00", "usb-Klipper_123"], "/dev": ["ttyUSB0"]}
+    mocker.patch("matrix_flow.step_04_configure._list_dir", side_effect=lambda path: listings.get(path, []))
 
     # Exécution
     helper = ConfigHelper()
@@ -32,7 +45,7 @@ def test_configuration_generation_with_device_found(mocker, capsys):
 def test_configuration_generation_with_device_not_found(mocker, capsys):
     """Vérifie que le bloc de configuration contient un placeholder si aucun port n'est trouvé."""
     # Simule l'échec de la détection de port
-    mocker.patch("glob.glob", return_value=[])
+    mocker.patch("matrix_flow.step_04_configure._list_dir", return_value=[])
 
     # Exécution
     helper = ConfigHelper()
@@ -43,3 +56,27 @@ def test_configuration_generation_with_device_not_found(mocker, capsys):
     clean_output = strip_ansi(captured.out)
     assert "[mcu bmcu]" in clean_output
     assert "serial: /dev/tty...." in clean_output
+
+
+def test_detect_serial_device_priority(mocker):
+    """Vérifie l'ordre de priorité : by-id d'abord, puis ttyCH avant ttyACM et ttyUSB."""
+    listings = {"/dev/serial/by-id": ["usb-other"], "/dev": ["ttyACM0", "ttyCH341USB0", "ttyS0", "ttyUSB0"]}
+    list_dir = mocker.patch("matrix_flow.step_04_configure._list_dir", side_effect=lambda path: listings.get(path, []))
+
+    assert ConfigHelper().detect_serial_device() == "/dev/ttyCH341USB0"
+    assert [call.args[0] for call in list_dir.call_args_list] == ["/dev/serial/by-id", "/dev"]
+
+
+def test_last_device_only_breaks_ties_in_best_group(mocker, tmp_path):
+    """Vérifie que le dernier port utilisé départage le meilleur groupe sans passer devant un lien by-id."""
+    listings = {"/dev/serial/by-id": ["usb-1a86_USB_Serial-if00"], "/dev": ["ttyUSB0", "ttyUSB1"]}
+    mocker.patch("matrix_flow.step_04_configure._list_dir", side_effect=lambda path: listings.get(path, []))
+    (tmp_path / "last_device").write_text("/dev/ttyUSB1\n", encoding="utf-8")
+
+    assert ConfigHelper().detect_serial_device() == "/dev/serial/by-id/usb-1a86_USB_Serial-if00"
+
+    listings["/dev/serial/by-id"] = []
+    assert ConfigHelper().detect_serial_device() == "/dev/ttyUSB1"
+
+    listings["/dev"] = ["ttyCH341USB0", "ttyUSB1"]
+    assert ConfigHelper().detect_serial_device() == "/dev/ttyCH341USB0"
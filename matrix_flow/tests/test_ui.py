@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""Tests pour le module d'interface utilisateur."""
+
+import importlib
+import signal
+import pytest
+
+from matrix_flow import ui
+
+def test_print_table_keeps_every_header(capsys):
+    """Vérifie que tous les en-têtes sont affichés, même sans données ou avec des lignes incomplètes."""
+    ui.print_table(["#", "Périphérique", "État"], [])
+    header, separator = capsys.readouterr().out.splitlines()
+    assert "État" in header
+    assert separator == "--+-" + "-" * len("Périphérique") + "-+-" + "-" * len("État")
+
+    ui.print_table(["#", "Périphérique", "État"], [["1", "/dev/ttyUSB0"], ["2"]])
+    header, separator, *rows = capsys.readouterr().out.splitlines()
+    assert "État" in header
+    assert separator.count("+") == 2
+    assert rows == ["1 | /dev/ttyUSB0", "2"]
+
+@pytest.mark.skipif(not hasattr(signal, "SIGWINCH"), reason="SIGWINCH indisponible")
+def test_import_keeps_host_sigwinch_handler():
+    """Vérifie que l'import du module ne remplace pas le gestionnaire SIGWINCH de l'hôte."""
+    def host_handler(signum, frame):
+        pass
+
+    previous = signal.signal(signal.SIGWINCH, host_handler)
+    try:
+        importlib.reload(ui)
+        assert signal.getsignal(signal.SIGWINCH) is host_handler
+    finally:
+        signal.signal(signal.SIGWINCH, previous)
+
+def test_header_follows_columns(monkeypatch):
+    """Vérifie que la largeur de l'en-tête suit les changements de COLUMNS."""
+    monkeypatch.setenv("COLUMNS", "40")
+    assert ui.format_header("abc").count("=") == 2 * ((40 - 3 - 2) // 2)
+    monkeypatch.setenv("COLUMNS", "60")
+    assert ui.format_header("abc").count("=") == 2 * ((60 - 3 - 2) // 2)
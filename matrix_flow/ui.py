@@ -8,7 +8,10 @@ Ce module centralise les fonctions et les styles pour l'affichage
 dans la console, garantissant une expérience utilisateur cohérente.
 """
 
+import functools
 import shutil
+import sys
+import threading
 from pathlib import Path
 
 # --- Définitions des couleurs ANSI ---
@@ -24,76 +27,96 @@ class AnsiColors:
     GREY = "\033[90m"
     RESET = "\033[0m"
 
-# Cache pour le contenu du fichier bannière
-_banner_content = None
+# Dictionnaire des couleurs substituées dans la bannière, construit à l'import
+_BANNER_COLORS = {
+    key: value
+    for key, value in vars(AnsiColors).items()
+    if not key.startswith("__") and isinstance(value, str)
+}
 
+def _read_terminal_width() -> int:
+    """
+    Lit la largeur du terminal (80 colonnes par défaut). Relue à chaque
+    en-tête : un seul ioctl, qui suit les redimensionnements et `COLUMNS`
+    sans gestionnaire de signal installé à l'import.
+    """
+    return shutil.get_terminal_size((80, 20)).columns
+
+# Gabarits des messages, construits une fois (une seule substitution par appel)
+_SUCCESS_FMT = f"{AnsiColors.GREEN}✔ %s{AnsiColors.RESET}"
+_ERROR_FMT = f"{AnsiColors.RED}✖ %s{AnsiColors.RESET}"
+_WARNING_FMT = f"{AnsiColors.YELLOW}⚠ %s{AnsiColors.RESET}"
+_INFO_FMT = f"{AnsiColors.BLUE}ℹ %s{AnsiColors.RESET}"
+
+# Verrou partagé pour éviter l'entrelacement des messages émis par plusieurs threads
+_print_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
 def get_banner() -> str:
     """
     Charge la bannière depuis le fichier assets/banner.txt.
-    Met en cache le contenu après la première lecture.
+    Le contenu est mis en cache après la première lecture.
     """
-    global _banner_content
-    if _banner_content is None:
-        try:
-            banner_path = Path(__file__).parent.parent / "assets/banner.txt"
-            _banner_content = banner_path.read_text(encoding="utf-8")
-        except FileNotFoundError:
-            _banner_content = "MatrixFlow"
-    return _banner_content
+    try:
+        banner_path = Path(__file__).parent.parent / "assets/banner.txt"
+        return banner_path.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return "MatrixFlow"
+
+@functools.lru_cache(maxsize=1)
+def _formatted_banner() -> str:
+    """Retourne la bannière mise en forme, calculée une seule fois."""
+    # str.format_map() assure une substitution sécurisée, évitant eval().
+    return get_banner().format_map(_BANNER_COLORS)
 
 def print_banner():
     """Affiche la bannière MatrixFlow."""
-    # Création d'un dictionnaire de couleurs à partir de la classe AnsiColors.
-    # On utilise str.format() pour une substitution sécurisée, évitant eval().
-    colors = {
-        key: value
-        for key, value in AnsiColors.__dict__.items()
-        if not key.startswith("__")
-    }
-    banner = get_banner().format(**colors)
-    print(banner)
+    print(_formatted_banner())
+
+def format_header(text: str) -> str:
+    """Retourne la ligne d'en-tête de section, sans l'afficher."""
+    padding = (_read_terminal_width() - len(text) - 2) // 2
+    return f"{AnsiColors.CYAN}{'=' * padding} {AnsiColors.WHITE}{text.upper()} {AnsiColors.CYAN}{'=' * padding}{AnsiColors.RESET}"
 
 def print_header(text: str):
     """Affiche un en-tête de section."""
-    width = shutil.get_terminal_size((80, 20)).columns
-    padding = (width - len(text) - 2) // 2
-    print(f"\n{AnsiColors.CYAN}{'=' * padding} {AnsiColors.WHITE}{text.upper()} {AnsiColors.CYAN}{'=' * padding}{AnsiColors.RESET}")
+    print(f"\n{format_header(text)}")
 
 def print_success(text: str):
     """Affiche un message de succès."""
-    print(f"{AnsiColors.GREEN}✔ {text}{AnsiColors.RESET}")
+    with _print_lock:
+        print(_SUCCESS_FMT % (text,))
 
 def print_error(text: str):
     """Affiche un message d'erreur."""
-    print(f"{AnsiColors.RED}✖ {text}{AnsiColors.RESET}", file=__import__("sys").stderr)
+    with _print_lock:
+        print(_ERROR_FMT % (text,), file=sys.stderr)
 
 def print_warning(text: str):
     """Affiche un message d'avertissement."""
-    print(f"{AnsiColors.YELLOW}⚠ {text}{AnsiColors.RESET}")
+    with _print_lock:
+        print(_WARNING_FMT % (text,))
 
 def print_info(text: str):
     """Affiche un message d'information."""
-    print(f"{AnsiColors.BLUE}ℹ {text}{AnsiColors.RESET}")
+    with _print_lock:
+        print(_INFO_FMT % (text,))
 
 def print_table(headers: list[str], data: list[list[str]]):
     """Affiche des données dans un tableau formaté."""
-    # Calcul de la largeur de chaque colonne
-    col_widths = [len(h) for h in headers]
-    for row in data:
-        for i, cell in enumerate(row):
-            if len(cell) > col_widths[i]:
-                col_widths[i] = len(cell)
-
-    # Ligne d'en-tête
-    header_line = " | ".join(f"{AnsiColors.WHITE}{headers[i]:<{col_widths[i]}}{AnsiColors.RESET}" for i in range(len(headers)))
-    separator = "-+-".join("-" * w for w in col_widths)
-    print(header_line)
-    print(separator)
-
-    # Données
-    for row in data:
-        row_line = " | ".join(f"{cell:<{col_widths[i]}}" for i, cell in enumerate(row))
-        print(row_line)
+    # Largeur de chaque colonne : lignes complétées au nombre d'en-têtes puis
+    # transposées par zip(), pour qu'aucun en-tête ne soit perdu.
+    padded = [list(row) + [""] * (len(headers) - len(row)) for row in data]
+    columns = list(zip(*padded)) if padded else [()] * len(headers)
+    col_widths = [max(len(header), max(map(len, column), default=0)) for header, column in zip(headers, columns)]
+
+    # En-tête, séparateur puis données, émis en une seule écriture
+    lines = [
+        " | ".join(f"{AnsiColors.WHITE}{header:<{width}}{AnsiColors.RESET}" for header, width in zip(headers, col_widths)),
+        "-+-".join("-" * width for width in col_widths),
+    ]
+    lines.extend(" | ".join(f"{cell:<{width}}" for cell, width in zip(row, col_widths)) for row in data)
+    print("\n".join(lines))
 
 def ask_confirmation(prompt: str) -> bool:
     """Demande une confirmation (oui/non) à l'utilisateur."""
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+MatrixFlow - Fonctions utilitaires partagées entre les étapes.
+
+Les résultats coûteux et stables pendant l'exécution du workflow (lecture de
+config.json, recherche d'exécutables dans le PATH) sont mémorisés ici afin
+que chaque étape n'ait pas à les recalculer.
+"""
+
+import functools
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+# Préfixes des périphériques série USB suivis par `UdevSerialWatcher`.
+SERIAL_NODE_PREFIXES = ("/dev/ttyUSB", "/dev/ttyACM", "/dev/ttyCH")
+SERIAL_BY_ID_PREFIX = "/dev/serial/by-id/"
+
+# Dernier port série utilisé avec succès, conservé entre deux exécutions.
+LAST_DEVICE_PATH = Path.home() / ".cache" / "matrixflow" / "last_device"
+
+@functools.lru_cache(maxsize=None)
+def _load_json_cached(path: str, mtime_ns: int) -> dict:
+    """Parse un fichier JSON ; la date de modification fait partie de la clé de cache."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_config(path: Path) -> dict:
+    """
+    Charge config.json une seule fois par version du fichier.
+
+    Le dictionnaire retourné est partagé entre les appelants et ne doit pas
+    être modifié. Lève `FileNotFoundError` ou `json.JSONDecodeError`.
+    """
+    return _load_json_cached(str(path), os.stat(path).st_mtime_ns)
+
+@functools.lru_cache(maxsize=None)
+def which(name: str, path: str | None = None) -> str | None:
+    """Version mémorisée de `shutil.which` (PATH du processus, ou `path`)."""
+    return shutil.which(name, path=path)
+
+def cached_device_among(candidates: list[str]) -> str | None:
+    """
+    Retourne le dernier port série utilisé s'il figure parmi `candidates`
+    (ports qui viennent d'être détectés), sinon `None`. Un nom comme
+    `/dev/ttyUSB0`, réattribué à un autre adaptateur ou disparu, n'est
+    ainsi jamais repris à l'aveugle.
+    """
+    try:
+        device = LAST_DEVICE_PATH.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    return device if device and device in candidates else None
+
+def save_cached_device(device: str):
+    """Mémorise le port série utilisé pour la prochaine exécution."""
+    try:
+        LAST_DEVICE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        LAST_DEVICE_PATH.write_text(device + "\n", encoding="utf-8")
+    except OSError:
+        pass
+
+class UdevSerialWatcher:
+    """
+    Liste des ports série USB tenue à jour par les événements udev.
+
+    Les périphériques du sous-système `tty` sont énumérés une seule fois, puis
+    un observateur udev met à jour la liste lors des branchements et
+    débranchements : une détection ne fait plus aucun accès à `/dev`.
+    """
+
+    def __init__(self):
+        # Module optionnel (pip install pyudev), importé seulement ici : les
+        # étapes qui n'énumèrent pas de ports ne le chargent jamais.
+        import pyudev
+        self._lock = threading.Lock()
+        self._devices: dict[str, tuple[list[str], str]] = {}
+        context = pyudev.Context()
+        for device in context.list_devices(subsystem="tty"):
+            self._add(device)
+        monitor = pyudev.Monitor.from_netlink(context)
+        monitor.filter_by(subsystem="tty")
+        self._observer = pyudev.MonitorObserver(monitor, callback=self._on_event, daemon=True)
+        self._observer.start()
+
+    def _add(self, device):
+        node = device.device_node
+        if not node or not node.startswith(SERIAL_NODE_PREFIXES):
+            return
+        links = sorted(link for link in device.device_links if link.startswith(SERIAL_BY_ID_PREFIX))
+        with self._lock:
+            self._devices[device.device_path] = (links, node)
+
+    def _on_event(self, device):
+        if device.action == "remove":
+            with self._lock:
+                self._devices.pop(device.device_path, None)
+        else:
+            self._add(device)
+
+    def snapshot(self) -> list[str]:
+        """Retourne les liens `/dev/serial/by-id`, puis les nœuds `/dev/tty*`."""
+        with self._lock:
+            entries = list(self._devices.values())
+        links = sorted(link for device_links, _ in entries for link in device_links)
+        nodes = sorted(node for _, node in entries)
+        return links + nodes
+
+@functools.lru_cache(maxsize=None)
+def serial_watcher() -> UdevSerialWatcher | None:
+    """
+    Retourne l'observateur udev partagé, ou `None` si pyudev est absent ou si
+    udev n'est pas accessible (conteneur, système non Linux...).
+    """
+    try:
+        return UdevSerialWatcher()
+    except (OSError, ImportError):
+        return None